@@ -274,14 +274,15 @@ var GaiaApps = {
     );
   },
 
-  launch: function(app, appName, launchPath, entryPoint) {
+  launch: function(app, appName, launchPath, entryPoint, aCallback) {
+    var callback = aCallback || marionetteScriptFinished;
     if (app) {
       let manifestURL = app.manifestURL;
       let origin = app.origin;
 
       let sendResponse = function() {
         let result = GaiaApps.getDisplayedApp();
-        marionetteScriptFinished(result);
+        callback(result);
       };
 
       let displayedApp = GaiaApps.getDisplayedApp();
@@ -318,10 +319,49 @@ var GaiaApps = {
         app.launch(entryPoint || null);
       }
     } else {
-      marionetteScriptFinished(false);
+      callback(false);
     }
   },
 
+  // Launches app with the specified name like launchWithName, adding the
+  // launch timing to the result: the time of the launch request since the
+  // epoch, and the time in ms from it to the app being opened and, when the
+  // app was not running, to its frame being created and first painted.
+  launchWithTiming: function(name) {
+    let timing = {start: Date.now()};
+    let frame = null;
+
+    let onCreated = function(evt) {
+      window.removeEventListener('appcreated', onCreated);
+      timing.frameCreated = Date.now() - timing.start;
+      frame = evt.detail.browser && evt.detail.browser.element;
+      if (frame) {
+        frame.addEventListener('mozbrowserfirstpaint', function onPaint() {
+          frame.removeEventListener('mozbrowserfirstpaint', onPaint);
+          timing.firstPaint = Date.now() - timing.start;
+        });
+      }
+    };
+    window.addEventListener('appcreated', onCreated);
+
+    GaiaApps.locateWithName(name, function(app, appName, launchPath, ep) {
+      GaiaApps.launch(app, appName, launchPath, ep, function(result) {
+        window.removeEventListener('appcreated', onCreated);
+        if (!result) {
+          marionetteScriptFinished(false);
+          return;
+        }
+        timing.opened = Date.now() - timing.start;
+        result.timing = timing;
+        // the first paint may be reported after the app is opened
+        waitFor(
+          function() { marionetteScriptFinished(result); },
+          function() { return !frame || timing.firstPaint !== undefined; }
+        );
+      });
+    });
+  },
+
   // Launches app with the specified name (e.g., 'Calculator'); returns the
   // an object with the app frame if successful, false if the app can't be
   // found, or times out if the app frame can't be found after launching the
@@ -396,6 +436,74 @@ var GaiaApps = {
     };
     return result;
   },
+
+  // Listens to the window manager and app install events, counting the
+  // changes to the installed, running and displayed apps. The counts are kept
+  // on the system window so they outlive the sandbox of this script, and have
+  // an id which changes with the system app, so clients can tell whether the
+  // apps they cached are still current.
+  watchApps: function() {
+    let win = window.wrappedJSObject;
+    if (win.gaiatestAppState) {
+      return win.gaiatestAppState;
+    }
+    let state = win.gaiatestAppState = {
+      id: Date.now() + '-' + Math.random().toString(36).slice(2),
+      installed: 0,
+      running: 0,
+      displayed: 0
+    };
+    let count = function(kinds) {
+      return function() {
+        kinds.forEach(function(kind) {
+          state[kind]++;
+        });
+      };
+    };
+    ['appcreated', 'appterminated'].forEach(function(type) {
+      window.addEventListener(type, count(['running', 'displayed']));
+    });
+    // every app, activity, popup, trusted UI, search and child window also
+    // publishes its events under the window prefix
+    ['windowopened', 'windowclosed', 'windowterminated'].forEach(
+      function(type) {
+        window.addEventListener(type, count(['displayed']));
+      });
+    // browser events do not bubble, but can be captured on their way down
+    window.addEventListener('mozbrowserlocationchange',
+                            count(['displayed']), true);
+    navigator.mozApps.mgmt.addEventListener('install', count(['installed']));
+    navigator.mozApps.mgmt.addEventListener('uninstall', count(['installed']));
+    return state;
+  },
+
+  // Returns the change counts of the apps. When the count of the given kind
+  // of apps, 'installed', 'running' or 'displayed', differs from the known
+  // one, the apps themselves are returned too, as getInstalledApps,
+  // getRunningApps(includeSystemApps) and getDisplayedApp would.
+  getAppState: function(kind, knownId, knownCount, includeSystemApps) {
+    let state = GaiaApps.watchApps();
+    let result = {
+      id: state.id,
+      installed: state.installed,
+      running: state.running,
+      displayed: state.displayed
+    };
+    if (state.id === knownId && state[kind] === knownCount) {
+      marionetteScriptFinished(result);
+    } else if (kind === 'installed') {
+      let req = navigator.mozApps.mgmt.getAll();
+      req.onsuccess = function() {
+        result.apps = req.result;
+        marionetteScriptFinished(result);
+      };
+    } else {
+      result.apps = kind === 'running' ?
+                    GaiaApps.getRunningApps(includeSystemApps) :
+                    GaiaApps.getDisplayedApp();
+      marionetteScriptFinished(result);
+    }
+  },
   /**
   * Install the app with the specified ManifestURL
   */
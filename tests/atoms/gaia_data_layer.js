@@ -4,7 +4,7 @@
 
 'use strict';
 /* global marionetteScriptFinished, pair, mozContact, i */
-/* global waitFor, aContacts */
+/* global waitFor, aContacts, Services, Components */
 /* exported pair, discovery, GaiaDataLayer */
 /* jshint -W083 */
 
@@ -64,14 +64,17 @@ var GaiaDataLayer = {
     this.setBluetooth('enabled');
   },
 
-  insertContact: function(aContact) {
-    // requires the 'contacts-create' permission
+  createMozContact: function(aContact) {
     if (aContact.photo) {
       var blob = GaiaDataLayer.base64ToBlob(aContact.photo, 'image/jpg');
       aContact.photo = [blob];
     }
+    return new mozContact(aContact);
+  },
 
-    var contact = new mozContact(aContact);
+  insertContact: function(aContact) {
+    // requires the 'contacts-create' permission
+    var contact = GaiaDataLayer.createMozContact(aContact);
     var req = window.navigator.mozContacts.save(contact);
     req.onsuccess = function() {
       console.log('success saving contact');
@@ -83,6 +86,35 @@ var GaiaDataLayer = {
     };
   },
 
+  insertContacts: function(aContacts, aCallback) {
+    // requires the 'contacts-create' permission
+    var callback = aCallback || marionetteScriptFinished;
+    var contactsLength = aContacts.length;
+    var done = 0;
+    var saved = 0;
+    if (contactsLength === 0) {
+      callback(0);
+      return;
+    }
+    aContacts.forEach(function(aContact) {
+      var contact = GaiaDataLayer.createMozContact(aContact);
+      var req = window.navigator.mozContacts.save(contact);
+      req.onsuccess = function() {
+        saved++;
+        if (++done === contactsLength) {
+          console.log('success saving ' + saved + ' contacts');
+          callback(saved);
+        }
+      };
+      req.onerror = function() {
+        console.error('error saving contact', req.error.name);
+        if (++done === contactsLength) {
+          callback(saved);
+        }
+      };
+    });
+  },
+
   insertSIMContact: function(aType, aContact) {
 
     // Get 1st SIM
@@ -141,6 +173,20 @@ var GaiaDataLayer = {
     };
   },
 
+  getContactsCount: function(aCallback) {
+    // requires 'contacts-read' permission
+    var callback = aCallback || marionetteScriptFinished;
+    var req = window.navigator.mozContacts.getCount();
+    req.onsuccess = function() {
+      console.log('success counting contacts');
+      callback(req.result);
+    };
+    req.onerror = function() {
+      console.error('error counting contacts ' + req.error.name);
+      callback(-1);
+    };
+  },
+
   getSIMContacts: function(aType, aCallback) {
     var type = aType || 'adn';
     var callback = aCallback || marionetteScriptFinished;
@@ -164,24 +210,16 @@ var GaiaDataLayer = {
   },
 
   removeAllContacts: function() {
-    var self = this;
-    this.getAllContacts(function(aContacts) {
-      if (aContacts.length > 0) {
-        var contactsLength = aContacts.length;
-        var done = 0;
-        for (var i = 0; i < contactsLength; i++) {
-          self.removeContact(aContacts[i], function() {
-            if (++done === contactsLength) {
-              marionetteScriptFinished(true);
-            }
-          });
-        }
-      }
-      else {
-        console.log('no contacts to remove');
-          marionetteScriptFinished(true);
-      }
-    });
+    // requires the 'contacts-write' permission
+    var req = window.navigator.mozContacts.clear();
+    req.onsuccess = function() {
+      console.log('success removing all contacts');
+      marionetteScriptFinished(true);
+    };
+    req.onerror = function() {
+      console.error('error removing all contacts ' + req.error.name);
+      marionetteScriptFinished(false);
+    };
   },
 
   removeContact: function(aContact, aCallback) {
@@ -214,6 +252,34 @@ var GaiaDataLayer = {
     };
   },
 
+  getSettings: function(aNames, aCallback) {
+    // requires the 'settings-read' and 'settings-api-read' permissions
+    var callback = aCallback || marionetteScriptFinished;
+    var lock = window.navigator.mozSettings.createLock();
+    var result = {};
+    var pending = aNames.length;
+    if (pending === 0) {
+      callback(result);
+      return;
+    }
+    aNames.forEach(function(aName) {
+      var req = lock.get(aName);
+      req.onsuccess = function() {
+        result[aName] = req.result[aName];
+        if (--pending === 0) {
+          console.log(aNames.length + ' settings retrieved');
+          callback(result);
+        }
+      };
+      req.onerror = function() {
+        console.log('error getting setting ' + aName + ' ' + req.error.name);
+        if (--pending === 0) {
+          callback(result);
+        }
+      };
+    });
+  },
+
   setSetting: function(aName, aValue, aReturnOnSuccess) {
     // requires the 'settings-write' and 'settings-api-write' permissions
     var returnOnSuccess = aReturnOnSuccess || aReturnOnSuccess === undefined;
@@ -234,6 +300,38 @@ var GaiaDataLayer = {
     };
   },
 
+  setSettings: function(aSettings, aCallback) {
+    // requires the 'settings-write' and 'settings-api-write' permissions
+    var callback = aCallback || marionetteScriptFinished;
+    var names = Object.keys(aSettings);
+    if (names.length === 0) {
+      console.log('no settings to change');
+      callback(true);
+      return;
+    }
+    console.log('setting ' + names.length + ' settings in a single lock');
+    var lock = window.navigator.mozSettings.createLock();
+    var req = lock.set(aSettings);
+    lock.onsettingstransactionsuccess = function() {
+      console.log('settings changed');
+      callback(true);
+    };
+    lock.onsettingstransactionfailure = function() {
+      console.log('error changing settings ' + req.error.name);
+      callback(false);
+    };
+  },
+
+  setPrefs: function(aPrefs) {
+    // must be run from the chrome context; each item is [type, name, value]
+    // where type is one of 'Bool', 'Int' or 'Char'
+    aPrefs.forEach(function(aPref) {
+      console.log('setting pref ' + aPref[1] + ' to ' + aPref[2]);
+      Services.prefs['set' + aPref[0] + 'Pref'](aPref[1], aPref[2]);
+    });
+    return true;
+  },
+
   connectToWiFi: function(aNetwork, aCallback) {
     var callback = aCallback || marionetteScriptFinished;
     var manager = window.navigator.mozWifiManager;
@@ -599,6 +697,77 @@ var GaiaDataLayer = {
     }
   },
 
+  insertSms: function(aMessages, aCallback) {
+    // must be run from the chrome context; the messages are saved straight
+    // into the mobile message database instead of going over the radio
+    var callback = aCallback || marionetteScriptFinished;
+    var service = Components.classes[
+      '@mozilla.org/mobilemessage/gonkmobilemessagedatabaseservice;1']
+      .getService(Components.interfaces.nsIGonkMobileMessageDatabaseService);
+    var messages = aMessages.slice();
+    var saved = 0;
+
+    function notify(aRv) {
+      if (Components.isSuccessCode(aRv)) {
+        saved++;
+      } else {
+        console.error('error saving sms message: ' + aRv);
+      }
+      saveNext();
+    }
+
+    function saveNext() {
+      var message = messages.shift();
+      if (!message) {
+        console.log('success saving ' + saved + ' sms messages');
+        callback(saved);
+        return;
+      }
+      if (message.delivery === 'received') {
+        service.saveReceivedMessage(message, notify);
+        return;
+      }
+      service.saveSendingMessage(message, function(aRv, aDomMessage) {
+        if (!Components.isSuccessCode(aRv)) {
+          notify(aRv);
+          return;
+        }
+        service.setMessageDeliveryByMessageId(
+          aDomMessage.id, message.receiver, 'sent', null, null, notify);
+      });
+    }
+
+    saveNext();
+  },
+
+  insertCallEntries: function(aCalls, aCallback) {
+    // must be run in the call log; the entries are added one after the other
+    // as concurrent calls from the same number would race to create a group
+    var callback = aCallback || marionetteScriptFinished;
+    var manager = window.wrappedJSObject.CallLogDBManager;
+    var calls = aCalls.slice();
+    var added = 0;
+
+    function addNext() {
+      var call = calls.shift();
+      if (!call) {
+        console.log('success adding ' + added + ' call log entries');
+        callback(added);
+        return;
+      }
+      manager.add(call, function(aResult) {
+        if (typeof aResult === 'object') {
+          added++;
+        } else {
+          console.error('error adding call log entry: ' + aResult);
+        }
+        addNext();
+      });
+    }
+
+    addNext();
+  },
+
   deleteAllAlarms: function() {
     window.wrappedJSObject.AlarmManager.getAlarmList(function(aList) {
       aList.forEach(function(aAlarm) {
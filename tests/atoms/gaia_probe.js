@@ -0,0 +1,131 @@
+/* This Source Code Form is subject to the terms of the Mozilla Public
+ * License, v. 2.0. If a copy of the MPL was not distributed with this file,
+ * You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+'use strict';
+/* global XPathResult */
+/* exported GaiaProbe */
+
+var GaiaProbe = {
+
+  // Returns the first element of the document matching the locator, like
+  // Marionette's findElement without waiting, or null.
+  find: function(aUsing, aValue) {
+    switch (aUsing) {
+      case 'id':
+        return document.getElementById(aValue);
+      case 'css selector':
+        return document.querySelector(aValue);
+      case 'class name':
+        return document.getElementsByClassName(aValue)[0] || null;
+      case 'name':
+        return document.getElementsByName(aValue)[0] || null;
+      case 'tag name':
+        return document.getElementsByTagName(aValue)[0] || null;
+      case 'xpath':
+        return document.evaluate(aValue, document, null,
+          XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+      case 'link text':
+      case 'partial link text': {
+        let links = document.getElementsByTagName('a');
+        for (let i = 0; i < links.length; i++) {
+          let text = links[i].textContent.trim();
+          if (aUsing == 'link text' ? text == aValue :
+              text.indexOf(aValue) != -1) {
+            return links[i];
+          }
+        }
+        return null;
+      }
+    }
+    throw new Error('Unsupported locator strategy: ' + aUsing);
+  },
+
+  // Returns all the elements of aRoot, or of the document, matching the
+  // locator, like Marionette's findElements without waiting.
+  findAll: function(aUsing, aValue, aRoot) {
+    let root = aRoot || document;
+    let all = function(aSelector) {
+      return Array.prototype.slice.call(root.querySelectorAll(aSelector));
+    };
+    switch (aUsing) {
+      case 'id':
+        return all('[id]').filter(function(e) { return e.id == aValue; });
+      case 'css selector':
+        return all(aValue);
+      case 'class name':
+        return Array.prototype.slice.call(
+          root.getElementsByClassName(aValue));
+      case 'name':
+        return all('[name]').filter(function(e) {
+          return e.getAttribute('name') == aValue;
+        });
+      case 'tag name':
+        return Array.prototype.slice.call(root.getElementsByTagName(aValue));
+      case 'xpath': {
+        let result = document.evaluate(aValue, root, null,
+          XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        let elements = [];
+        for (let i = 0; i < result.snapshotLength; i++) {
+          elements.push(result.snapshotItem(i));
+        }
+        return elements;
+      }
+      case 'link text':
+      case 'partial link text':
+        return all('a').filter(function(e) {
+          let text = e.textContent.trim();
+          return aUsing == 'link text' ? text == aValue :
+            text.indexOf(aValue) != -1;
+        });
+    }
+    throw new Error('Unsupported locator strategy: ' + aUsing);
+  },
+
+  rect: function(aElement) {
+    let rect = aElement.getBoundingClientRect();
+    return {
+      x: rect.left + window.pageXOffset,
+      y: rect.top + window.pageYOffset,
+      width: rect.width,
+      height: rect.height
+    };
+  },
+
+  // Returns the state of all the elements of aRoot, or of the document,
+  // matching the locator: the element, its text, its rect and the values of
+  // the attributes named in aAttributes. Whether elements are displayed is
+  // left to Marionette.
+  snapshot: function(aUsing, aValue, aAttributes, aRoot) {
+    return GaiaProbe.findAll(aUsing, aValue, aRoot).map(function(element) {
+      let attributes = {};
+      aAttributes.forEach(function(name) {
+        attributes[name] = element.getAttribute(name);
+      });
+      let text = element.innerText !== undefined ?
+        element.innerText : element.textContent;
+      return {
+        element: element,
+        text: (text || '').trim(),
+        rect: GaiaProbe.rect(element),
+        attributes: attributes
+      };
+    });
+  },
+
+  // Returns whether an element matches each of aLocators, a list of
+  // [using, value] pairs, with the first element matching and its rect.
+  probe: function(aLocators) {
+    return aLocators.map(function(locator) {
+      let element = GaiaProbe.find(locator[0], locator[1]);
+      if (!element) {
+        return {present: false, rect: null, element: null};
+      }
+      return {
+        present: true,
+        rect: GaiaProbe.rect(element),
+        element: element
+      };
+    });
+  }
+};
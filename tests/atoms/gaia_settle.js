@@ -0,0 +1,70 @@
+/* This Source Code Form is subject to the terms of the Mozilla Public
+ * License, v. 2.0. If a copy of the MPL was not distributed with this file,
+ * You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+'use strict';
+/* global marionetteScriptFinished */
+/* exported GaiaSettle */
+
+var GaiaSettle = {
+
+  // must be run from the chrome context, draws the screen at this scale
+  scale: 0.25,
+
+  frameChecksum: function(aContext, aWidth, aHeight) {
+    aContext.drawWindow(window, 0, 0, window.innerWidth, window.innerHeight,
+                        'rgb(255,255,255)',
+                        aContext.DRAWWINDOW_USE_WIDGET_LAYERS);
+    var data = aContext.getImageData(0, 0, aWidth, aHeight).data;
+    var hash = 0;
+    for (var i = 0; i < data.length; i += 4) {
+      hash = ((hash << 5) - hash + data[i] +
+              (data[i + 1] << 8) + (data[i + 2] << 16)) | 0;
+    }
+    return hash;
+  },
+
+  // Finishes with true once aStableFrames samples in a row are unchanged, the
+  // screen having changed before or aMinWait having passed, since the screen
+  // may not have started to change yet when called right after a gesture.
+  waitForStableFrames: function(aInterval, aTimeout, aStableFrames, aMinWait,
+                                aCallback) {
+    var callback = aCallback || marionetteScriptFinished;
+    var self = this;
+    var width = Math.ceil(window.innerWidth * this.scale);
+    var height = Math.ceil(window.innerHeight * this.scale);
+    var canvas = document.createElementNS('http://www.w3.org/1999/xhtml',
+                                          'canvas');
+    canvas.setAttribute('width', width);
+    canvas.setAttribute('height', height);
+    var context = canvas.getContext('2d');
+    context.scale(this.scale, this.scale);
+
+    var start = Date.now();
+    var previous = null;
+    var stable = 0;
+    var changed = false;
+
+    function sample() {
+      var checksum = self.frameChecksum(context, width, height);
+      if (checksum === previous) {
+        stable++;
+      } else {
+        changed = changed || previous !== null;
+        stable = 0;
+      }
+      previous = checksum;
+      if (stable >= aStableFrames &&
+          (changed || Date.now() - start >= (aMinWait || 0))) {
+        console.log('screen settled after ' + (Date.now() - start) + 'ms');
+        callback(true);
+      } else if (Date.now() - start >= aTimeout) {
+        console.log('screen still changing after ' + aTimeout + 'ms');
+        callback(false);
+      } else {
+        window.setTimeout(sample, aInterval);
+      }
+    }
+    sample();
+  }
+};
@@ -0,0 +1,134 @@
+/* This Source Code Form is subject to the terms of the Mozilla Public
+ * License, v. 2.0. If a copy of the MPL was not distributed with this file,
+ * You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+'use strict';
+/* global GaiaProbe, marionetteScriptFinished */
+/* exported GaiaWait */
+
+var GaiaWait = {
+
+  // Checks the condition described by aSpec, the caller checks it again the
+  // way Marionette does once it is met.
+  check: function(aSpec, aElement) {
+    var negate = aSpec.condition.indexOf('not_') === 0;
+    var condition = aSpec.condition.replace(/^not_/, '');
+    var element = aElement || (aSpec.using ?
+      GaiaProbe.find(aSpec.using, aSpec.value) : null);
+    if (element && !document.documentElement.contains(element)) {
+      element = null;
+    }
+
+    var result = !!element;
+    if (result) {
+      switch (condition) {
+        case 'displayed':
+          // the loose checks may only err towards the condition being met
+          result = negate ? !GaiaWait.mayBeHidden(element) :
+                            GaiaWait.mayBeShown(element);
+          break;
+        case 'enabled':
+          result = !element.disabled;
+          break;
+        case 'selected':
+          result = !!(element.selected || element.checked);
+          break;
+        case 'attribute':
+          result = element.getAttribute(aSpec.name) === aSpec.expected;
+          break;
+        case 'class':
+          result = element.classList.contains(aSpec.name);
+          break;
+      }
+    }
+    return negate ? !result : result;
+  },
+
+  // Whether the element could be displayed: neither it nor an ancestor is
+  // hidden by its style. Marionette may still find it hidden, such as when it
+  // has no size, is transparent or is outside of an ancestor hiding its
+  // overflow.
+  mayBeShown: function(aElement) {
+    if (window.getComputedStyle(aElement).visibility != 'visible') {
+      return false;
+    }
+    for (var e = aElement; e && e.nodeType == 1; e = e.parentElement) {
+      if (window.getComputedStyle(e).display == 'none') {
+        return false;
+      }
+    }
+    return true;
+  },
+
+  // Whether Marionette could find the element hidden: it may not be shown,
+  // has no size, an ancestor is transparent or it is not within an ancestor
+  // clipping its overflow.
+  mayBeHidden: function(aElement) {
+    if (!GaiaWait.mayBeShown(aElement)) {
+      return true;
+    }
+    var rect = aElement.getBoundingClientRect();
+    if (rect.width <= 0 || rect.height <= 0) {
+      return true;
+    }
+    for (var e = aElement; e && e.nodeType == 1; e = e.parentElement) {
+      var style = window.getComputedStyle(e);
+      if (parseFloat(style.opacity) === 0) {
+        return true;
+      }
+      if (e != aElement && style.overflow != 'visible') {
+        var r = e.getBoundingClientRect();
+        if (rect.left < r.left || rect.right > r.right ||
+            rect.top < r.top || rect.bottom > r.bottom) {
+          return true;
+        }
+      }
+    }
+    return false;
+  },
+
+  // Waits for the condition described by aSpec to be met in the document of
+  // the current frame, checking it whenever the document changes or a
+  // transition or animation ends. Finishes with true once the condition is
+  // met, or with false after aTimeout ms.
+  until: function(aSpec, aElement, aTimeout, aCallback) {
+    var callback = aCallback || marionetteScriptFinished;
+    if (GaiaWait.check(aSpec, aElement)) {
+      callback(true);
+      return;
+    }
+
+    var observer = null;
+    var timer = null;
+    var events = ['transitionend', 'animationend'];
+
+    function finish(aResult) {
+      observer.disconnect();
+      window.clearTimeout(timer);
+      events.forEach(function(type) {
+        window.removeEventListener(type, onChange, true);
+      });
+      callback(aResult);
+    }
+
+    function onChange() {
+      if (GaiaWait.check(aSpec, aElement)) {
+        finish(true);
+      }
+    }
+
+    observer = new window.MutationObserver(onChange);
+    observer.observe(document, {
+      attributes: true,
+      characterData: true,
+      childList: true,
+      subtree: true
+    });
+    events.forEach(function(type) {
+      window.addEventListener(type, onChange, true);
+    });
+    timer = window.setTimeout(function() {
+      finish(false);
+    }, aTimeout);
+  }
+};
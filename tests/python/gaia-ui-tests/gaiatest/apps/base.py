@@ -5,10 +5,11 @@
 import time
 
 from marionette_driver import expected, By, Wait
-from marionette_driver.errors import NoSuchElementException
 
 from gaiatest import GaiaApps
 from gaiatest import Accessibility
+from gaiatest import ElementProbe
+from gaiatest import SettleDetector
 
 
 class Base(object):
@@ -26,23 +27,18 @@ class Base(object):
         self.app = self.apps.launch(self.name, self.manifest_url, self.entry_point, launch_timeout=launch_timeout)
 
     def is_element_present(self, by, locator):
-        self.marionette.set_search_timeout(0)
-        try:
-            self.marionette.find_element(by, locator)
-            return True
-        except NoSuchElementException:
-            return False
-        finally:
-            self.marionette.set_search_timeout(self.marionette.timeout or 10000)
+        return ElementProbe(self.marionette).is_present(by, locator)
 
     def is_element_displayed(self, by, locator):
-        self.marionette.set_search_timeout(0)
-        try:
-            return self.marionette.find_element(by, locator).is_displayed()
-        except NoSuchElementException:
-            return False
-        finally:
-            self.marionette.set_search_timeout(self.marionette.timeout or 10000)
+        return ElementProbe(self.marionette).is_displayed(by, locator)
+
+    def snapshot_elements(self, by, locator, attributes=()):
+        """Returns snapshots of the text, displayed state, rect and attributes of the matching elements.
+
+        All the elements are read by a single script, so page objects can filter
+        them without a round trip per element.
+        """
+        return ElementProbe(self.marionette).snapshot(by, locator, attributes)
 
     def find_select_item(self, match_string):
         _list_item_locator = (By.CSS_SELECTOR, 'section.value-selector-container li label')
@@ -70,9 +66,9 @@ class Base(object):
 
         # TODO we should find something suitable to wait for, but this goes too
         # fast against desktop builds causing intermittent failures
-        # This sleep is necessary to make sure the select is completely faded out,
+        # This wait is necessary to make sure the select is completely faded out,
         # see bug 1148154
-        time.sleep(1)
+        SettleDetector(self.marionette).wait(1)
 
     def select(self, match_string, tap_close=True):
         # cheeky Select wrapper until Marionette has its own
@@ -136,3 +132,7 @@ class PageRegion(Base):
     def __init__(self, marionette, element):
         self.root_element = element
         Base.__init__(self, marionette)
+
+    def snapshot_elements(self, by, locator, attributes=()):
+        """Like :meth:`Base.snapshot_elements`, for the elements within the region."""
+        return ElementProbe(self.marionette).snapshot(by, locator, attributes, root=self.root_element)
@@ -75,7 +75,9 @@ class Homescreen(Base):
 
     @property
     def visible_apps(self):
-        return [homescreen_element for homescreen_element in self.app_elements if homescreen_element.is_displayed]
+        return [self.GaiaAppIcon(self.marionette, icon.element, icon)
+                for icon in self.snapshot_elements(*self._all_icons_locator, attributes=['data-identifier'])
+                if icon.displayed]
 
     def wait_for_number_of_apps(self, number_of_apps=1):
         Wait(self.marionette).until(lambda m: len(self.app_elements) >= number_of_apps)
@@ -119,8 +121,15 @@ class Homescreen(Base):
 
     class GaiaAppIcon(PageRegion):
 
+        def __init__(self, marionette, element, snapshot=None):
+            PageRegion.__init__(self, marionette, element)
+            self.snapshot = snapshot
+
         @property
         def manifest_url(self):
+            # the identifier of an icon does not change, so a snapshot of it can be used
+            if self.snapshot is not None:
+                return self.snapshot.get_attribute('data-identifier')
             return self.root_element.get_attribute('data-identifier')
 
         @property
@@ -3,11 +3,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
+
 from marionette_driver import expected, By, Wait
+from marionette_driver.errors import StaleElementException, TimeoutException
 from marionette_driver.marionette import Actions
 
 from gaiatest.apps.base import Base
 from gaiatest.apps.system.app import System
+from gaiatest.wait import MutationWait, element_present
 
 
 class Keyboard(Base):
@@ -80,9 +84,15 @@ class Keyboard(Base):
     _upper_case_key = '20'
     _space_key = '32'
 
+    # time in seconds for the keyboard to change page or case when typing quickly
+    _state_change_delay = 0.2
+    # time in seconds for the text typed quickly to reach the input
+    _typing_timeout = 2
+
     # keyboard app locators
     _keyboard_active_frame_locator = (By.CSS_SELECTOR, '#keyboards .inputWindow.active iframe')
     _input_window_locator = (By.CSS_SELECTOR, '#keyboards .inputWindow')
+    _active_keys_locator = (By.CSS_SELECTOR, '.keyboard-type-container[data-active] button.keyboard-key')
     _button_locator = (By.CSS_SELECTOR, '.keyboard-type-container[data-active] button.keyboard-key[data-keycode="%s"], .keyboard-type-container[data-active] button.keyboard-key[data-keycode-upper="%s"]')
     _highlight_key_locator = (By.CSS_SELECTOR, '#keyboard-accent-char-menu button')
     _predicted_word_locator = (By.CSS_SELECTOR, '.autocorrect')
@@ -175,8 +185,8 @@ class Keyboard(Base):
 
     # this is to tap on desired key on keyboard
     def _tap(self, val):
-        key = Wait(self.marionette).until(expected.element_present(*self._key_locator(val)))
-        Wait(self.marionette).until(expected.element_displayed(key))
+        key = MutationWait(self.marionette).until(element_present(*self._key_locator(val)))
+        MutationWait(self.marionette).until(expected.element_displayed(key))
         Actions(self.marionette).press(key).release().perform()
 
         # These two tap cases are most important because they cause the keyboard to change state which affects next step
@@ -220,8 +230,28 @@ class Keyboard(Base):
         self.apps.switch_to_displayed_app()
 
     # this would go through fastest way to tap/click through a string
-    def send(self, string):
+    def send(self, string, strict=False):
+        """Types string with the keyboard.
+
+        Unless strict is set, the keys of the current layout are read once and
+        the whole string is typed with a single action chain, then the value of
+        the focused input is checked. Strings the quick way cannot type, such as
+        those with characters found by long pressing a key or typed into inputs
+        where the keyboard corrects or capitalizes words, and strings it failed
+        to type are typed key by key, waiting for the keyboard after each key.
+        """
+        before = None
+        if not strict and all(ord(val) <= 127 for val in string):
+            self.apps.switch_to_displayed_app()
+            before = self._text_before_caret
         self.switch_to_keyboard()
+        if before is not None:
+            string = self._send_quickly(string, before)
+        if string:
+            self._send_strictly(string)
+        self.apps.switch_to_displayed_app()
+
+    def _send_strictly(self, string):
         for val in string:
             if ord(val) > 127:
                 # this would get the right key to long press and switch to the right keyboard
@@ -248,7 +278,188 @@ class Keyboard(Base):
                     Wait(self.marionette).until(
                         lambda m: self._layout_page == 0)
 
+    def _send_quickly(self, string, before):
+        """Types string with a single action chain, returns what is left to type key by key.
+
+        Starts in the keyboard frame, before being the text before the caret of
+        the focused input of the displayed app. Ends in the frame of the
+        displayed app if the string was typed, else in the keyboard frame.
+        """
+        if self._assists_typing:
+            # the keyboard would change what is typed
+            return string
+        pages = self._read_layout(string)
+        taps = self._plan_taps(string, pages)
+        if taps is None:
+            return string
+
+        action = Actions(self.marionette)
+        for key, changes_state in taps:
+            action.press(key).release()
+            if changes_state:
+                action.wait(self._state_change_delay)
+        try:
+            action.perform()
+        except StaleElementException:
+            # the keyboard rendered a page again, what was typed is checked below
+            pass
+
+        self.apps.switch_to_displayed_app()
+        try:
+            Wait(self.marionette, timeout=self._typing_timeout).until(
+                lambda m: self._text_before_caret == before + string)
+            return ''
+        except TimeoutException:
+            after = self._text_before_caret
+        self.switch_to_keyboard()
+        if after is None:
+            # the text cannot be read, typing key by key will tell what went wrong
+            return string
+
+        # erase what was typed, and whatever the keyboard changed before it, so it
+        # can be typed again key by key
+        kept = os.path.commonprefix([before, after])
+        backspace = self.marionette.find_element(*self._key_locator(self._backspace_key))
+        action = Actions(self.marionette)
+        for i in range(len(after) - len(kept)):
+            action.press(backspace).release()
+        action.perform()
         self.apps.switch_to_displayed_app()
+        Wait(self.marionette, timeout=self._typing_timeout).until(lambda m: self._text_before_caret == kept)
+        self.switch_to_keyboard()
+        return before[len(kept):] + string
+
+    def _read_layout(self, string):
+        """Returns the keys of the layout pages needed to type string, starting from the basic page in lower case.
+
+        Each page maps the characters it can type to their key and whether
+        shift must be pressed first, and the pages it can switch to to their
+        page switching key.
+        """
+        if self._layout_page != 0:
+            self._tap_page_switching_key(0)
+            Wait(self.marionette).until(lambda m: self._layout_page == 0)
+        if self._is_upper_case:
+            self._tap(self._upper_case_key)
+            Wait(self.marionette).until(lambda m: not self._is_upper_case)
+
+        pages = {0: self._read_page()}
+        missing = set(string) - set(pages[0][0])
+        page = 0
+        for target in (1, 2):
+            if not missing or target not in pages[page][1]:
+                break
+            self._tap_page_switching_key(target)
+            Wait(self.marionette).until(lambda m: self._layout_page == target)
+            pages[target] = self._read_page()
+            missing -= set(pages[target][0])
+            page = target
+        if page != 0:
+            self._tap_page_switching_key(0)
+            Wait(self.marionette).until(lambda m: self._layout_page == 0)
+        return pages
+
+    def _read_page(self):
+        keys = {}
+        switches = {}
+        for key in self.snapshot_elements(
+                *self._active_keys_locator, attributes=['data-keycode', 'data-keycode-upper', 'data-target-page']):
+            # whether each key is displayed would cost a round trip, should a hidden
+            # key be tapped the text typed is wrong and send types key by key
+            code = key.get_attribute('data-keycode')
+            upper = key.get_attribute('data-keycode-upper')
+            target = key.get_attribute('data-target-page')
+            if target is not None and target.isdigit():
+                switches[int(target)] = key.element
+            if code is not None and code.isdigit() and int(code) < 128:
+                keys.setdefault(chr(int(code)), (key.element, False))
+            if upper is not None and upper.isdigit() and upper != code and int(upper) < 128:
+                keys.setdefault(chr(int(upper)), (key.element, True))
+        return keys, switches
+
+    def _plan_taps(self, string, pages):
+        """Returns the keys to tap to type string and whether each changes the state of the keyboard.
+
+        Returns None if a character or a page switching key is missing.
+        """
+        shift = chr(int(self._upper_case_key))
+        taps = []
+        page = 0
+        for val in string:
+            if val not in pages[page][0]:
+                target = next((p for p in sorted(pages) if val in pages[p][0]), None)
+                if target is None:
+                    return None
+                route = self._find_route(pages, page, target)
+                if route is None:
+                    return None
+                for step in route:
+                    taps.append((pages[page][1][step], True))
+                    page = step
+            key, needs_shift = pages[page][0][val]
+            if needs_shift:
+                if shift not in pages[page][0]:
+                    return None
+                taps.append((pages[page][0][shift][0], True))
+            # space and '@' switch back to the basic page, see bug 996332
+            changes_state = needs_shift or (page != 0 and (val.isspace() or val == '@'))
+            taps.append((key, changes_state))
+            if val.isspace() or val == '@':
+                page = 0
+        return taps
+
+    def _find_route(self, pages, start, target):
+        """Returns the shortest list of pages to switch to, to go from the start page to the target one."""
+        routes = {start: []}
+        queue = [start]
+        while queue:
+            page = queue.pop(0)
+            if page == target:
+                return routes[page]
+            for step in sorted(pages[page][1]):
+                if step in pages and step not in routes:
+                    routes[step] = routes[page] + [step]
+                    queue.append(step)
+        return None
+
+    @property
+    def _text_before_caret(self):
+        # read from the focused input of the current frame, as the text before the cursor
+        # the keyboard is told of is cut to its last 100 characters
+        return self.marionette.execute_script("""
+          var element = document.activeElement;
+          if (!element || typeof element.value != 'string') {
+            return null;
+          }
+          var start = null;
+          try {
+            start = element.selectionStart;
+          } catch (e) {
+          }
+          // inputs such as email ones have no selection, the caret is at the end
+          return element.value.substring(0, typeof start == 'number' ? start : element.value.length);""")
+
+    @property
+    def _assists_typing(self):
+        # whether the keyboard capitalizes or corrects what is typed, following latin.js,
+        # when the keyboard app cannot tell it is assumed to so strings are typed key by key
+        return self.marionette.execute_script("""
+          try {
+            var app = window.wrappedJSObject.app;
+            var context = app.inputContext;
+            if (!context || ['text', 'textarea', 'search'].indexOf(context.inputType) == -1 ||
+                ['verbatim', 'numeric', 'digit'].indexOf(context.inputMode) != -1) {
+              return false;
+            }
+            var mode = context.inputMode;
+            if (mode == 'latin-prose' || (context.inputType == 'textarea' && mode != 'latin')) {
+              return true;
+            }
+            var settings = app.inputMethodManager.imEngineSettings.getSettingsSync();
+            return settings.correctionsEnabled !== false;
+          } catch (e) {
+            return true;
+          }""") is not False
 
     # Switch keyboard language
     # Mapping of language code => {
@@ -0,0 +1,204 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+from collections import OrderedDict
+import json
+import math
+import sys
+
+from marionette_driver import Wait
+from marionette_driver.errors import TimeoutException
+from marionette_driver.marionette import Marionette
+
+import gaiatest
+from gaiatest.tracing import percentile
+
+# performance marks apps make once loaded
+MARKS = ('visuallyLoaded', 'fullyLoaded')
+
+
+def statistics(values):
+    """Returns the mean, median, 95th percentile and standard deviation of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    mean = sum(values) / float(len(values))
+    return OrderedDict([
+        ('count', len(values)),
+        ('mean', round(mean, 1)),
+        ('median', round(percentile(values, 50), 1)),
+        ('p95', round(percentile(values, 95), 1)),
+        ('stddev', round(math.sqrt(sum((v - mean) ** 2 for v in values) / len(values)), 1))])
+
+
+class GaiaBench(object):
+
+    def __init__(self):
+        self.commands = {
+            'launch': {
+                'function': self.launch,
+                'args': [
+                    {'name': '--iterations',
+                     'type': int,
+                     'default': 5,
+                     'help': 'Number of cold and of warm launches of each app '
+                             '(default: %(default)s)'},
+                    {'name': '--app',
+                     'dest': 'apps',
+                     'action': 'append',
+                     'metavar': 'NAME',
+                     'help': 'Name of an app to launch, may be repeated '
+                             '(default: all installed apps)'},
+                    {'name': '--mark-timeout',
+                     'type': int,
+                     'default': 10000,
+                     'help': 'Time in ms to wait for the performance marks of '
+                             'an app (default: %(default)s)'},
+                    {'name': '--output',
+                     'metavar': 'PATH',
+                     'help': 'Write the results as JSON to PATH'}],
+                'help': 'Measure the time taken to launch apps'}}
+
+        self.parser = argparse.ArgumentParser()
+        self.add_options(self.parser)
+        self.add_commands(self.parser)
+
+    def run(self, args=sys.argv[1:]):
+        args = self.parser.parse_args(args)
+
+        host, port = args.address.split(':')
+        self.marionette = Marionette(host=host, port=int(port))
+        self.marionette.start_session()
+
+        self.apps = gaiatest.GaiaApps(self.marionette)
+        self.device = gaiatest.GaiaDevice(self.marionette)
+
+        ret = args.func(args)
+        if ret is None:
+            ret = 0
+
+        self.marionette.delete_session()
+
+        sys.exit(ret)
+
+    def add_options(self, parser):
+        parser.add_argument(
+            '--address',
+            default='localhost:2828',
+            help='Address (host:port) of running Gecko instance to connect to '
+                 '(default: %(default)s)')
+
+    def add_commands(self, parser):
+        subparsers = parser.add_subparsers(
+            title='Commands', metavar='<command>')
+        for (name, props) in sorted(self.commands.iteritems()):
+            subparser = subparsers.add_parser(name, help=props['help'])
+            if props.get('args'):
+                for arg in props['args']:
+                    kwargs = {k: v for k, v in arg.items() if k != 'name'}
+                    subparser.add_argument(arg['name'], **kwargs)
+            subparser.set_defaults(func=props['function'])
+
+    def launch(self, args):
+        if self.device.is_locked:
+            self.device.unlock()
+        self.marionette.switch_to_frame()
+        names = args.apps or sorted(set(a.name for a in self.apps.installed_apps))
+
+        results = OrderedDict()
+        for name in names:
+            print 'Launching %s' % name
+            samples = {'cold': [], 'warm': []}
+            try:
+                for i in range(args.iterations):
+                    self.apps.kill_all()
+                    samples['cold'].append(self.launch_app(name, args.mark_timeout))
+                for i in range(args.iterations):
+                    self.go_home()
+                    samples['warm'].append(self.launch_app(name, args.mark_timeout))
+            except Exception as e:
+                print 'Failed to launch %s: %s' % (name, e)
+                results[name] = {'error': str(e)}
+                continue
+            finally:
+                self.marionette.switch_to_frame()
+
+            results[name] = OrderedDict(
+                (kind, self.summarize(samples[kind])) for kind in ('cold', 'warm'))
+            self.print_results(name, results[name])
+
+        self.apps.kill_all()
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        failed = [name for name, result in results.items() if 'error' in result]
+        return 1 if failed else 0
+
+    def launch_app(self, name, mark_timeout):
+        """Launch the app and return its launch timing in ms."""
+        self.marionette.switch_to_frame()
+        result = self.marionette.execute_async_script(
+            'GaiaApps.launchWithTiming(%s)' % json.dumps(name))
+        assert result, "Failed to launch app with name '%s'" % name
+        timing = result['timing']
+        sample = dict((k, v) for k, v in timing.items() if k != 'start')
+        if 'frameCreated' in timing:
+            # the marks are only made when the app is loaded, so on cold launches
+            self.marionette.switch_to_frame(result['frame'])
+            marks = self.wait_for_marks(mark_timeout)
+            sample.update((k, v - timing['start']) for k, v in marks.items())
+            self.marionette.switch_to_frame()
+        return sample
+
+    def wait_for_marks(self, timeout):
+        """Returns the times since the epoch of the performance marks made by the app."""
+        script = """
+          var marks = {};
+          var start = window.performance.timing.navigationStart;
+          arguments[0].forEach(function(name) {
+            var entries = window.performance.getEntriesByName(name, 'mark');
+            if (entries.length) {
+              marks[name] = start + entries[0].startTime;
+            }
+          });
+          return marks;
+        """
+        marks = {}
+        try:
+            Wait(self.marionette, timeout=timeout / 1000.0, interval=0.1).until(
+                lambda m: marks.update(m.execute_script(script, [list(MARKS)])) or
+                len(marks) == len(MARKS))
+        except TimeoutException:
+            # some apps never report being fully loaded
+            pass
+        return marks
+
+    def go_home(self):
+        self.marionette.switch_to_frame()
+        displayed = self.apps.displayed_app.origin
+        self.marionette.execute_script(
+            "window.wrappedJSObject.dispatchEvent(new Event('home'));")
+        Wait(self.marionette).until(
+            lambda m: self.apps.displayed_app.origin != displayed)
+
+    def summarize(self, samples):
+        names = sorted(set(k for sample in samples for k in sample))
+        return OrderedDict(
+            (name, statistics([s[name] for s in samples if name in s])) for name in names)
+
+    def print_results(self, name, result):
+        for kind, measures in result.items():
+            for measure, stats in measures.items():
+                print '  %s %-14s mean %7.1f  median %7.1f  p95 %7.1f  stddev %6.1f (ms, n=%d)' % (
+                    kind, measure, stats['mean'], stats['median'], stats['p95'],
+                    stats['stddev'], stats['count'])
+
+
+def cli(args=sys.argv[1:]):
+    bench = GaiaBench()
+    bench.run(args)
+
+if __name__ == '__main__':
+    cli()
@@ -3,12 +3,55 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from abc import ABCMeta, abstractmethod
+import glob
+import hashlib
+from multiprocessing.pool import ThreadPool
 import os
+import pipes
+import posixpath
+import re
 import shutil
 
 import mozlog
 
 
+_digests = {}
+
+
+def file_digest(path):
+    """Returns the SHA-1 hex digest of a local file, cached until the file is modified."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _digests:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                sha1.update(block)
+        _digests[key] = sha1.hexdigest()
+    return _digests[key]
+
+
+def indexed_filename(filename, index):
+    """Make a filename unique by including an index before its extension."""
+    if '.' in filename:
+        return '_%s.'.join(iter(filename.rsplit('.', 1))) % index
+    return '%s_%s' % (filename, index)
+
+
+def parse_file_line(tokens):
+    """Returns the modification time, size and name of a file in a long listing line."""
+    # the size precedes the modification date
+    for i, token in enumerate(tokens[1:], 1):
+        if re.match(r'^\d{4}-\d{2}-\d{2}$', token) and tokens[i - 1].isdigit():
+            return ' '.join(tokens[i:i + 2]), int(tokens[i - 1]), ' '.join(tokens[i + 2:])
+    return None, 0, tokens[-1]
+
+
+def parse_files(output):
+    """Returns the modification time, size and name of each file in a long listing."""
+    return [parse_file_line(line.split()) for line in output.splitlines() if line.startswith('-')]
+
+
 class GaiaFileManager(object):
     """Abstract file manager for Gaia."""
     __metaclass__ = ABCMeta
@@ -34,13 +77,7 @@ class GaiaFileManager(object):
         # We copy the file we've just created rather than pushing it
         # multiple times, which would be much slower.
         for i in range(1, count + 1):
-            # Make the remote filename unique by including an index
-            if '.' in filename:
-                indexed_filename = '_%d.'.join(iter(
-                    filename.rsplit('.', 1))) % i
-            else:
-                indexed_filename = '%s_%d' % (filename, i)
-            duplicate = '/'.join([path, indexed_filename])
+            duplicate = '/'.join([path, indexed_filename(filename, i)])
             self.copy_file(original, duplicate)
         self.remove(original)
 
@@ -70,10 +107,29 @@ class GaiaFileManager(object):
     def remove(self, path):
         """Remove file or directory."""
 
+    @abstractmethod
+    def remove_many(self, paths, glob_children=True):
+        """Remove files and directories in bulk.
+
+        The last component of a path may be a glob pattern.
+
+        :param paths: list of paths to remove.
+        :param glob_children: remove everything inside each path, including
+            hidden entries, rather than the path itself.
+        :returns: the number of files and directories removed, not counting
+            what was inside them.
+        """
+
 
 class GaiaDeviceFileManager(GaiaFileManager):
     """File manager for Gaia instance running on a B2G device or emulator."""
 
+    # Pushed files are kept here, outside of the storage cleaned between tests.
+    # Set to None to push files directly to their destination.
+    cache_path = '/data/local/tmp/gaiatest-cache'
+    # The least recently used files are removed from the cache beyond this size.
+    cache_size = 256 * 1024 * 1024
+
     def copy_file(self, source, destination):
         self._logger.debug('Copying: %s to: %s' % (source, destination))
         self.device.manager.copyTree(source, destination)
@@ -82,6 +138,21 @@ class GaiaDeviceFileManager(GaiaFileManager):
         self._logger.debug('Checking for existance of directory: %s' % path)
         return self.device.manager.dirExists(path)
 
+    def duplicate_file(self, path, count):
+        """Create duplicates of a file on the device and remove original.
+
+        All copies are made by a single shell loop, so the length of the
+        command does not grow with the number of copies.
+        """
+        original = path
+        path, sep, filename = path.rpartition('/')
+        # the index is left outside of the quoted parts of the name to be expanded
+        duplicate = '"$i"'.join(pipes.quote(part) for part in
+                                '/'.join([path, indexed_filename(filename, '\0')]).split('\0'))
+        self._logger.debug('Duplicating: %s %d times' % (original, count))
+        self.shell('i=1; while [ $i -le %d ]; do cat %s > %s || exit 1; i=$((i + 1)); done; '
+                   'rm %s' % (count, pipes.quote(original), duplicate, pipes.quote(original)))
+
     def file_exists(self, path):
         self._logger.debug('Checking for existance of file: %s' % path)
         return self.device.manager.fileExists(path)
@@ -102,10 +173,94 @@ class GaiaDeviceFileManager(GaiaFileManager):
         filename = local_path.rpartition(os.path.sep)[-1]
         remote_file = '/'.join([remote_path, filename])
         self.make_dirs(remote_file)
-        self.device.manager.pushFile(local_path, remote_file)
+        if self.cache_path:
+            self._push_cached_file(local_path, remote_file)
+        else:
+            self.device.manager.pushFile(local_path, remote_file)
         if count > 1:
             self.duplicate_file(remote_file, count)
 
+    def _push_cached_file(self, local_path, remote_file):
+        """Copy a file from the device's content cache, pushing it there first if needed.
+
+        Cached files are keyed by the SHA-1 of their content, so a file is only
+        sent over adb once, however many tests push it. Copying a cached file
+        touches it, so the least recently used files are the first removed
+        when the cache grows beyond cache_size.
+        """
+        cached = posixpath.join(self.cache_path, file_digest(local_path))
+        output = self.shell('if [ -f %(cached)s ]; then touch %(cached)s 2>/dev/null; '
+                            'cat %(cached)s > %(remote)s && echo cached; fi' % {'cached': pipes.quote(cached),
+                                                      'remote': pipes.quote(remote_file)})
+        if output.strip() == 'cached':
+            self._logger.debug('Copied cached: %s to: %s' % (local_path, remote_file))
+            return
+        self._logger.debug('Pushing: %s to cache: %s' % (local_path, cached))
+        self.make_dirs(cached)
+        # push under a temporary name so an interrupted push is never mistaken for a cached file
+        self.device.manager.pushFile(local_path, '%s.tmp' % cached)
+        self.shell('mv %(cached)s.tmp %(cached)s && cat %(cached)s > %(remote)s' % {
+            'cached': pipes.quote(cached), 'remote': pipes.quote(remote_file)})
+        self._trim_cache(keep=posixpath.basename(cached))
+
+    def _trim_cache(self, keep):
+        """Remove the least recently used files beyond cache_size from the cache."""
+        files = sorted(parse_files(self.shell('ls -l %s' % pipes.quote(self.cache_path))), reverse=True)
+        total = 0
+        stale = []
+        for modified, size, name in files:
+            total += size
+            if total > self.cache_size and name != keep:
+                stale.append(posixpath.join(self.cache_path, name))
+        if stale:
+            self._logger.debug('Removing %d least recently used files from cache' % len(stale))
+            self.remove_many(stale, glob_children=False)
+
+    def clear_cache(self):
+        """Remove all files from the device's content cache."""
+        if self.cache_path:
+            self.remove(self.cache_path)
+
+    def remove_many(self, paths, glob_children=True, max_length=1000):
+        """Remove files and directories in bulk, using as few shell commands as possible.
+
+        Scripts are kept under max_length characters to stay within the limits
+        of adb shell command lines.
+
+        :raises DMError: if any path could not be removed, once all were tried.
+        """
+        words = []
+        for path in paths:
+            if glob_children:
+                path = pipes.quote(path.rstrip('/'))
+                words.extend(['%s/*' % path, '%s/.[!.]*' % path])
+            else:
+                parent, sep, name = path.rpartition('/')
+                words.append('%s/%s' % (pipes.quote(parent), name) if re.search(r'[*?[]', name)
+                             else pipes.quote(path))
+        removed = 0
+        while words:
+            chunk = [words.pop(0)]
+            while words and len(self._remove_script(chunk + words[:1])) < max_length:
+                chunk.append(words.pop(0))
+            self._logger.debug('Removing: %s' % ' '.join(chunk))
+            removed += self.shell(self._remove_script(chunk)).split().count('removed')
+        return removed
+
+    def _remove_script(self, words):
+        # patterns matching nothing are left as they are, so only existing paths are removed
+        return ('s=0; for p in %s; do if [ -e "$p" ] || [ -L "$p" ]; then '
+                'if rm -r "$p"; then echo removed; else s=1; fi; fi; done; exit $s' % ' '.join(words))
+
+    def shell(self, script):
+        """Run a shell script on the device in a single adb command and return its output.
+
+        Paths in the script should be quoted with pipes.quote.
+        """
+        # devicemanager wraps arguments containing spaces in single quotes without
+        # escaping them, so close and reopen the quoting around those in the script
+        return self.device.manager.shellCheckOutput(['sh', '-c', script.replace("'", "'\"'\"'")])
+
     def remove(self, path):
         self._logger.debug('Removing: %s' % path)
         self.device.manager.removeDir(path)
@@ -125,6 +280,21 @@ class GaiaLocalFileManager(GaiaFileManager):
         self._logger.debug('Checking for existance of directory: %s' % path)
         return os.path.isdir(path)
 
+    def duplicate_file(self, path, count):
+        """Create duplicates of a file as hard links and remove original.
+
+        Falls back to copying where the filesystem does not support hard links.
+        """
+        original = os.path.normpath(path)
+        path, sep, filename = path.rpartition('/')
+        for i in range(1, count + 1):
+            duplicate = os.path.normpath('/'.join([path, indexed_filename(filename, i)]))
+            try:
+                os.link(original, duplicate)
+            except (AttributeError, OSError):
+                self.copy_file(original, duplicate)
+        self.remove(original)
+
     def file_exists(self, path):
         path = os.path.normpath(path)
         self._logger.debug('Checking for existance of file: %s' % path)
@@ -172,3 +342,23 @@ class GaiaLocalFileManager(GaiaFileManager):
         elif os.path.isdir(path):
             self._logger.debug('Removing directory: %s' % path)
             shutil.rmtree(path)
+
+    def remove_many(self, paths, glob_children=True, workers=4):
+        """Remove files and directories in bulk, using a pool of threads."""
+        targets = []
+        for path in paths:
+            path = os.path.normpath(path)
+            if glob_children:
+                targets.extend(glob.glob(os.path.join(path, '*')))
+                targets.extend(glob.glob(os.path.join(path, '.*')))
+            else:
+                targets.extend(glob.glob(path))
+        if not targets:
+            return 0
+        pool = ThreadPool(min(workers, len(targets)))
+        try:
+            pool.map(self.remove, targets)
+        finally:
+            pool.close()
+            pool.join()
+        return len(targets)
@@ -4,20 +4,149 @@
 
 
 import datetime
+import hashlib
+import json
 import os
-import subprocess
-import time
+import struct
+from multiprocessing.pool import ThreadPool
 from StringIO import StringIO
 
+import numpy
 from PIL import Image
 from marionette_driver import expected, By
 from marionette_driver.marionette import Actions
 from marionette_driver.gestures import pinch, smooth_scroll
+import mozlog
 from mozlog.structured import get_default_logger
 
-from gaiatest import GaiaTestCase
+from gaiatest import FrameTracker, GaiaTestCase, SettleDetector
 from gaiatest.apps.system.app import System
 
+# colour of the mismatched pixels in diff images, as used by ImageMagick
+DIFF_HIGHLIGHT_COLOR = (241, 0, 30)
+
+# file caching the hashes of the reference images, stored along with them
+REFERENCE_HASHES_FILENAME = '.reference_hashes.json'
+
+
+def image_diff(target, reference, fuzz_value):
+    """Compare two images of the same size pixel by pixel.
+
+    Equivalent to ImageMagick's ``compare -metric AE -fuzz``: two pixels match
+    when the difference of their alpha channels, and the root mean square
+    difference of their red, green and blue channels weighted by their
+    opacity, are within fuzz_value percent of the full range.
+
+    :returns: the number of mismatched pixels and a boolean array marking them.
+    """
+    target = numpy.asarray(target.convert('RGBA'), dtype=numpy.float64) / 255
+    reference = numpy.asarray(reference.convert('RGBA'), dtype=numpy.float64) / 255
+    fuzz = numpy.square(fuzz_value / 100.0)
+    alpha = numpy.square(target[..., 3] - reference[..., 3])
+    # colours only matter as much as both pixels are opaque, as in IsMagickColorSimilar
+    opacity = target[..., 3] * reference[..., 3]
+    colour = numpy.square(target[..., :3] - reference[..., :3]).sum(axis=2)
+    mismatches = (alpha > fuzz) | (3 * alpha + opacity * colour > 3 * fuzz)
+    return int(numpy.count_nonzero(mismatches)), mismatches
+
+
+def diff_image(reference, mismatches):
+    """Returns a faded copy of the reference with the mismatched pixels highlighted."""
+    reference = reference.convert('RGB')
+    pixels = numpy.array(Image.blend(reference, Image.new('RGB', reference.size, 'white'), 0.8))
+    pixels[mismatches] = DIFF_HIGHLIGHT_COLOR
+    return Image.fromarray(pixels)
+
+
+def png_size(data):
+    """Returns the width and height of a PNG image, read from its header."""
+    return struct.unpack('>II', data[16:24])
+
+
+def image_digest(image):
+    """Returns a digest of the size and pixels of an image."""
+    return hashlib.sha1('%dx%d' % image.size + image.convert('RGBA').tobytes()).hexdigest()
+
+
+def image_dhash(image):
+    """Returns the 64 bit difference hash of an image, which is similar for similar images."""
+    pixels = numpy.asarray(image.convert('L').resize((9, 8), Image.ANTIALIAS), dtype=numpy.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def hash_distance(a, b):
+    """Returns the number of bits that differ between two image hashes."""
+    return bin(a ^ b).count('1')
+
+
+class GaiaReferenceStore(object):
+    """Index of the reference images in a directory, with cached hashes of them.
+
+    The directory is only listed once per run, and the hashes are persisted in
+    the directory, when it is writable, so references are only decoded again
+    when they change.
+    """
+
+    _stores = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes_path = os.path.join(path, REFERENCE_HASHES_FILENAME)
+        self.references = set(f for f in os.listdir(path) if f.endswith('.png'))
+        self.hashes = {}
+        self._modified = False
+        if os.path.isfile(self.hashes_path):
+            with open(self.hashes_path) as f:
+                self.hashes = json.load(f)
+
+    @classmethod
+    def get(cls, path):
+        """Returns the store for a directory, shared by all tests of the run."""
+        path = os.path.abspath(path)
+        if path not in cls._stores:
+            cls._stores[path] = cls(path)
+        return cls._stores[path]
+
+    def find(self, test, page, device, locale, index):
+        """Returns the path of the matching reference image, or None if there is none."""
+        # Format: test_name.page_name(parameter).locale.device_name.index.png
+        filename = '%s_%s_%s_%s_%s.png' % (test, page, device, locale, index)
+        if filename in self.references:
+            return os.path.join(self.path, filename)
+
+    def add(self, path):
+        """Add a reference image that has just been stored."""
+        filename = os.path.basename(path)
+        self.references.add(filename)
+        self.hashes.pop(filename, None)
+
+    def image_hashes(self, path):
+        """Returns the digest and difference hash of a reference image."""
+        filename = os.path.basename(path)
+        mtime = os.path.getmtime(path)
+        cached = self.hashes.get(filename)
+        if cached is None or cached['mtime'] != mtime:
+            image = Image.open(path)
+            cached = self.hashes[filename] = {
+                'mtime': mtime,
+                'digest': image_digest(image),
+                'dhash': image_dhash(image)}
+            self._modified = True
+        return cached['digest'], cached['dhash']
+
+    def save(self):
+        if self._modified and self.hashes_path:
+            try:
+                with open(self.hashes_path, 'w') as f:
+                    json.dump(self.hashes, f, sort_keys=True)
+            except (IOError, OSError) as e:
+                # the directory may be read only or shared, so only keep the hashes for this run
+                logger = get_default_logger() or mozlog.unstructured.getLogger('gaiatest')
+                logger.warning('Unable to save the hashes of the reference images: %s' % e)
+                self.hashes_path = None
+            self._modified = False
+
 
 class GaiaImageCompareTestCase(GaiaTestCase):
     def __init__(self, *args, **kwargs):
@@ -27,119 +156,197 @@ class GaiaImageCompareTestCase(GaiaTestCase):
         self.fuzz_factor = kwargs.pop('fuzz_factor')
         self.reference_path = kwargs.pop('reference_path')
         self.screenshots_path = kwargs.pop('screenshots_path')
+        self.hash_distance = kwargs.pop('hash_distance', None)
+        self.screenshot_workers = kwargs.pop('screenshot_workers', 2)
         self.mismatch_path = os.path.join(self.screenshots_path, 'mismatches')
 
         self.logger = get_default_logger()
         self.picture_index = 0
         self.test_passed = True
         self.failcomment = ""
+        self._crop_heights = {}
+        self._screenshot_pool = None
+        self._screenshot_results = []
 
         # set up directories
         if not os.path.exists(self.reference_path):
             os.makedirs(self.reference_path)
         if not os.path.exists(self.screenshots_path):
             os.makedirs(self.screenshots_path)
+        self.references = GaiaReferenceStore.get(self.reference_path)
 
     def setUp(self):
         GaiaTestCase.setUp(self)
         self.device_name = self.marionette.session_capabilities.get('device', 'unknown')
+        if self.screenshot_workers > 0:
+            # screenshots are cropped, saved and compared while the test continues
+            self._screenshot_pool = ThreadPool(self.screenshot_workers)
 
     def tearDown(self):
+        self.wait_for_screenshots()
         GaiaTestCase.tearDown(self)
+        self.references.save()
         """At the end of test execution, it checks for the errors"""
         self.assertTrue(self.test_passed, msg=self.failcomment)
 
+    def wait_for_screenshots(self):
+        """Wait for all screenshots to be processed and collect their failures."""
+        if self._screenshot_pool is not None:
+            self._screenshot_pool.close()
+            self._screenshot_pool.join()
+            self._screenshot_pool = None
+        for result in self._screenshot_results:
+            try:
+                self._add_failure(result.get())
+            except Exception as e:
+                self._add_failure('\nFailed to process screenshot: %s\n' % e)
+        self._screenshot_results = []
+
+    def _add_failure(self, comment):
+        if comment:
+            self.test_passed = False
+            self.failcomment += comment
+
     # if the status bar is visible, crop it off
     @property
     def crop_height(self):
         return int(System(self.marionette).status_bar.height
                    * self.marionette.execute_script('return window.wrappedJSObject.devicePixelRatio;'))
 
+    def _screenshot_crop_height(self, screenshot):
+        # the size of the screenshot tells the orientation of the screen, so the
+        # status bar only needs to be measured once per orientation
+        size = png_size(screenshot)
+        if size not in self._crop_heights:
+            self._crop_heights[size] = self.crop_height
+        return self._crop_heights[size]
+
     def take_screenshot(self, page_name=None, prewait=1, top_frame=False):
         """
         invokes screen capture event, crops the status bar, and saves to the file
         page_name: a (optional) name that is given to the screenshot image file
+        prewait: maximum time to wait for the screen to settle before taking the screenshot
         """
-        time.sleep(prewait)
+        SettleDetector(self.marionette).wait(prewait)
 
         # take screenshot
         self.marionette.set_context(self.marionette.CONTEXT_CHROME)
         screenshot = self.marionette.screenshot(format="binary")
         self.marionette.set_context(self.marionette.CONTEXT_CONTENT)
 
-        # Format: test_name.page_name(parameter).locale.device_name.index.png
-        reference_filename = os.path.join(self.reference_path, '%s_%s_%s_%s_%s.png' % (
-            self.methodName, page_name, self.device_name,
-            self.data_layer.get_setting('language.current'),
-            self.picture_index))
+        locale = self.data_layer.get_setting('language.current')
+        crop_height = self._screenshot_crop_height(screenshot)
 
         # determine the image file name (path included)
         if self.store_reference_image:
-            filename = reference_filename
+            # Format: test_name.page_name(parameter).locale.device_name.index.png
+            filename = os.path.join(self.reference_path, '%s_%s_%s_%s_%s.png' % (
+                self.methodName, page_name, self.device_name, locale, self.picture_index))
+            reference_filename = None
         else:
             # obtain screenshot filename
             # Format: test_name.page_name(parameter).locale.device_name.index.timestamp.png
             timestamp = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
             filename = os.path.join(self.screenshots_path, '%s_%s_%s_%s_%s+%s.png' % (
-                self.methodName, page_name, self.device_name,
-                self.data_layer.get_setting('language.current'),
+                self.methodName, page_name, self.device_name, locale,
                 self.picture_index, timestamp))
+            reference_filename = self.references.find(
+                self.methodName, page_name, self.device_name, locale, self.picture_index)
 
-        # save the image after cropping it
-        im = Image.open(StringIO(screenshot))
-        crop_box = (0, self.crop_height) + im.size
-        new_image = im.crop(crop_box)
-        new_image.save(filename)
-
-        # when not collecting reference image, compare the image to the reference
-        if self.store_reference_image is False:
-
-            # get the contents for the reference folder for a match
-            ref_file_list = os.listdir(self.reference_path)
-            for i, p in enumerate(ref_file_list):
-                ref_file_list[i] = os.path.join(self.reference_path, p)
-
-            if reference_filename in ref_file_list:
-                self.image_compare(filename, reference_filename,
-                                   "{0}_diff.png".format(filename[0:filename.find(".png")]), self.fuzz_factor)
-            else:
-                self.failcomment += "\nRef file not found for: " + filename + '\n'
-                self.test_passed = False
+        args = (screenshot, crop_height, filename, reference_filename)
+        if self._screenshot_pool is not None:
+            self._screenshot_results.append(self._screenshot_pool.apply_async(self._process_screenshot, args))
+        else:
+            self._add_failure(self._process_screenshot(*args))
 
-        # sometimes the frame should remain at the top level
+        # sometimes the frame should remain at the top level, measuring the
+        # status bar switched to it but the crop height is usually known
         if top_frame is False:
             self.apps.switch_to_displayed_app()
+        elif self.apps.frame_tracker.frame != FrameTracker.TOP:
+            self.marionette.switch_to_frame()
         self.picture_index += 1
 
-    def image_compare(self, target, ref, diff, fuzz_value):
-        """do single image compare using the convert console command of ImageMagick"""
-
-        p = subprocess.Popen(
-            ["compare", "-fuzz", str(fuzz_value) + "%", "-metric", "AE", target, ref, diff],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        p.wait()
-
-        if not (err.rstrip('\n') == '0'):
-            self.test_passed = False
+    def _process_screenshot(self, screenshot, crop_height, filename, reference_filename):
+        """crops and saves a screenshot, then compares it to its reference
 
-            # msg should be saved at this point. Otherwise, it will get lost if any of the below line fails
-            if len(err.split()) > 1:
-                self.failcomment += '\n' + err
-            else:
-                self.failcomment += '\nWARNING: ' + err.rstrip(
-                    '\n') + ' pixels mismatched between ' + target + ' and ' + ref + '\n'
+        runs outside of the test thread, so it must not use Marionette
+        returns the failure comment, if any"""
 
-            # move the diff image and the target image to a separate folder
-            if not os.path.exists(self.mismatch_path):
-                os.makedirs(self.mismatch_path)
-            target_image_name = target[target.rfind("/") + 1:]
-            os.rename(target, os.path.join(self.mismatch_path, target_image_name))
+        # save the image after cropping it
+        im = Image.open(StringIO(screenshot))
+        crop_box = (0, crop_height) + im.size
+        new_image = im.crop(crop_box)
+        new_image.save(filename)
 
-            # diff may not be generated if the image sizes do not match
-            if os.path.exists(diff):
-                diff_image_name = diff[diff.rfind("/") + 1:]
-                os.rename(diff, os.path.join(self.mismatch_path, diff_image_name))
+        if self.store_reference_image:
+            self.references.add(filename)
+        elif reference_filename is None:
+            return "\nRef file not found for: " + filename + '\n'
+        else:
+            # when not collecting reference image, compare the image to the reference
+            mismatched, message = self.compare_images(
+                filename, reference_filename, "{0}_diff.png".format(filename[0:filename.find(".png")]),
+                self.fuzz_factor, target_image=new_image)
+            if mismatched:
+                return message
+
+    def image_compare(self, target, ref, diff, fuzz_value, target_image=None):
+        """compare the target image file to the reference, saving an image of the differences on mismatch
+
+        target_image = the already decoded target image, to avoid reading it back from disk
+        returns the number of mismatched pixels"""
+        mismatched, message = self.compare_images(target, ref, diff, fuzz_value, target_image)
+        if mismatched:
+            self._add_failure(message)
+        return mismatched
+
+    def compare_images(self, target, ref, diff, fuzz_value, target_image=None):
+        """same as image_compare, but returns the number of mismatched pixels along with the
+        failure comment instead of failing the test"""
+
+        if target_image is None:
+            target_image = Image.open(target)
+
+        # skip the pixel comparison for identical, or similar enough, images
+        if os.path.dirname(os.path.abspath(ref)) == self.references.path:
+            digest, dhash = self.references.image_hashes(ref)
+            if image_digest(target_image) == digest:
+                return 0, None
+            if self.hash_distance is not None and \
+                    hash_distance(image_dhash(target_image), dhash) <= self.hash_distance:
+                return 0, None
+
+        ref_image = Image.open(ref)
+
+        if target_image.size != ref_image.size:
+            mismatched = target_image.size[0] * target_image.size[1]
+            message = '\nimage sizes differ between ' + target + ' (%dx%d)' % target_image.size + \
+                      ' and ' + ref + ' (%dx%d)' % ref_image.size + '\n'
+        else:
+            mismatched, mismatches = image_diff(target_image, ref_image, fuzz_value)
+            message = '\nWARNING: %d pixels mismatched between ' % mismatched + target + ' and ' + ref + '\n'
+
+        if mismatched:
+            try:
+                # move the target image to a separate folder, along with an image of the differences
+                try:
+                    os.makedirs(self.mismatch_path)
+                except OSError:
+                    # another screenshot may have created it already
+                    if not os.path.isdir(self.mismatch_path):
+                        raise
+                target_image_name = target[target.rfind("/") + 1:]
+                os.rename(target, os.path.join(self.mismatch_path, target_image_name))
+
+                # diff can not be generated if the image sizes do not match
+                if target_image.size == ref_image.size:
+                    diff_image_name = diff[diff.rfind("/") + 1:]
+                    diff_image(ref_image, mismatches).save(os.path.join(self.mismatch_path, diff_image_name))
+            except (IOError, OSError) as e:
+                message += 'Failed to save the mismatched images: %s\n' % e
+
+        return mismatched, message
 
     # Make UI action related methods static, so they can be used outside the GaiaImageCompareTestCase object as well.
     @staticmethod
@@ -176,7 +383,7 @@ class GaiaImageCompareTestCase(GaiaTestCase):
         if release:
             action.release()
         action.perform()
-        time.sleep(2)  # compensate for the time taken for edge scroll to bring another app to active
+        SettleDetector(marionette).wait(2)  # wait for edge scroll to bring another app to active
 
         return action
 
@@ -210,7 +417,7 @@ class GaiaImageCompareTestCase(GaiaTestCase):
 
         pinch(marionette, screen, init_index_x, init_index_y, init_thumb_x, init_thumb_y,
               -disp_x, -disp_y, disp_x, disp_y, duration)
-        time.sleep(2)  # compensate for the time taken for pinch to complete
+        SettleDetector(marionette).wait(2)  # wait for pinch to complete
 
     @staticmethod
     def scroll(marionette, direction, distance, locator=None, screen=None, increments=None):
@@ -237,4 +444,4 @@ class GaiaImageCompareTestCase(GaiaTestCase):
             vector = 0
 
         smooth_scroll(marionette, screen, axis, vector, distance, increments)
-        time.sleep(2)  # compensate for the time taken for dynamic scroll
+        SettleDetector(marionette).wait(2)  # wait for dynamic scroll to complete
@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+import itertools
 import json
 import os
 import sys
@@ -12,14 +14,17 @@ import time
 import datetime
 import signal
 import thread
+import weakref
 
 from marionette import MarionetteTestCase, B2GTestCaseMixin
 from marionette_driver import expected, By, Wait
-from marionette_driver.errors import NoSuchElementException, StaleElementException
+from marionette_driver.errors import NoSuchElementException, NoSuchFrameException, StaleElementException
 import mozfile
+import mozlog
 
 from environment import GaiaTestEnvironment
 from file_manager import GaiaDeviceFileManager, GaiaLocalFileManager
+from tracing import CommandTracer, PhaseTimer
 
 DEFAULT_SETTINGS = {
     'airplaneMode.enabled': False,  # disable airplane mode
@@ -58,6 +63,317 @@ DEFAULT_PREFS = {
 }
 
 
+def command_params(args, kwargs):
+    """Returns the parameters of a command, however they were passed to _send_message."""
+    # marionette_driver passes command parameters either as a dictionary or as keywords
+    params = args[0] if args and isinstance(args[0], dict) else kwargs.get('params')
+    return params if isinstance(params, dict) else kwargs
+
+
+class CommandHooks(object):
+    """Lets helpers watch, and skip, the commands sent by a Marionette session.
+
+    The command dispatch of a session is wrapped once, however many helpers
+    listen to it. A listener may define ``before_command(name, params)``,
+    returning True if the command need not be sent, and
+    ``after_command(name, params, result, error, duration)``, called once a
+    command was sent with the time it took in milliseconds.
+    """
+
+    _hooks = weakref.WeakKeyDictionary()
+
+    def __init__(self, marionette):
+        self.listeners = []
+        self._send = marionette._send_message
+        marionette._send_message = self._send_message
+
+    @classmethod
+    def get(cls, marionette):
+        """Returns the hooks of marionette, wrapping its command dispatch on first use."""
+        if marionette not in cls._hooks:
+            cls._hooks[marionette] = cls(marionette)
+        return cls._hooks[marionette]
+
+    def add(self, listener):
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _send_message(self, name, *args, **kwargs):
+        params = command_params(args, kwargs)
+        listeners = list(self.listeners)
+        for listener in listeners:
+            before = getattr(listener, 'before_command', None)
+            if before is not None and before(name, params):
+                return True
+        result = error = None
+        start = time.time()
+        try:
+            result = self._send(name, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = (time.time() - start) * 1000
+            for listener in listeners:
+                after = getattr(listener, 'after_command', None)
+                if after is not None:
+                    after(name, params, result, error, duration)
+
+
+class AtomRegistry(object):
+    """Tracks the atoms imported into each context of a Marionette session.
+
+    Atom files are read and hashed once per process and imported at most once
+    per context for every session, however many handles such as
+    :class:`GaiaApps` and :class:`GaiaData` are created. The registry forgets
+    the atoms when the session clears its imported scripts or is deleted.
+    """
+
+    _registries = weakref.WeakKeyDictionary()
+    _sources = {}
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        self.session_id = marionette.session_id
+        self.imported = set()
+        self.imports = 0
+        self.avoided = 0
+
+    @classmethod
+    def get(cls, marionette):
+        """Returns the registry of the current session of marionette."""
+        registry = cls._registries.get(marionette)
+        if registry is None or registry.session_id != marionette.session_id:
+            hooks = CommandHooks.get(marionette)
+            if registry is not None:
+                hooks.remove(registry)
+            registry = cls._registries[marionette] = cls(marionette)
+            hooks.add(registry)
+        return registry
+
+    @classmethod
+    def path(cls, name):
+        return os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', name))
+
+    @classmethod
+    def source(cls, name):
+        """Returns the source of an atom and its SHA-1 digest."""
+        if name not in cls._sources:
+            with open(cls.path(name), 'r') as f:
+                source = f.read()
+            cls._sources[name] = (source, hashlib.sha1(source).hexdigest())
+        return cls._sources[name]
+
+    def import_script(self, name, context=None):
+        """Import an atom into a context, unless it was already imported in this session.
+
+        :param name: file name of the atom.
+        :param context: context to import the atom into, content by default.
+        """
+        context = context or self.marionette.CONTEXT_CONTENT
+        key = (self.source(name)[1], context)
+        if key in self.imported:
+            self.avoided += 1
+            return
+        with self.marionette.using_context(context):
+            self.marionette.import_script(self.path(name))
+        self.imported.add(key)
+        self.imports += 1
+
+    def clear(self):
+        """Forget the imported atoms."""
+        self.imported.clear()
+
+    def after_command(self, name, params, result, error, duration):
+        if name in ('clearImportedScripts', 'deleteSession'):
+            # the scripts of every context are forgotten, importing some again is cheap
+            self.clear()
+
+
+class FrameTracker(object):
+    """Tracks the context and frame of a Marionette session to skip redundant frame switches.
+
+    The tracker listens to the session's :class:`CommandHooks` and is only
+    installed by :class:`GaiaTestCase`. Switching to the top level frame when
+    already there is skipped. The frame is forgotten on any command it does
+    not track.
+    """
+
+    TOP = 'top'
+
+    # commands which can neither change the apps nor the current frame
+    READ_ONLY_COMMANDS = (
+        'findElement', 'findElements', 'getActiveElement', 'getActiveFrame', 'getContext',
+        'getCurrentUrl', 'getElementAttribute', 'getElementLocation', 'getElementRect',
+        'getElementSize', 'getElementTagName', 'getElementText', 'getElementValueOfCssProperty',
+        'getPageSource', 'getSessionCapabilities', 'getTitle', 'getUrl', 'getWindowHandle',
+        'getWindowHandles', 'getWindowType', 'importScript', 'clearImportedScripts',
+        'isElementDisplayed', 'isElementEnabled', 'isElementSelected', 'setContext',
+        'setScriptTimeout', 'setSearchTimeout', 'switchToFrame', 'takeScreenshot', 'timeouts')
+
+    _trackers = weakref.WeakKeyDictionary()
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        self.switches = 0
+        self.skipped_switches = 0
+        self.reset()
+
+    @classmethod
+    def install(cls, marionette):
+        """Returns the tracker of marionette, installing it on first use."""
+        if marionette not in cls._trackers:
+            cls._trackers[marionette] = cls(marionette)
+            CommandHooks.get(marionette).add(cls._trackers[marionette])
+        return cls._trackers[marionette]
+
+    @classmethod
+    def get(cls, marionette):
+        """Returns the tracker of marionette, or None if none was installed."""
+        return cls._trackers.get(marionette)
+
+    def reset(self):
+        """Forget the current context and frame."""
+        self.context = None
+        self.frame = None
+
+    @property
+    def counters(self):
+        return {'switches': self.switches,
+                'skipped_switches': self.skipped_switches}
+
+    def _target(self, params):
+        frame = params.get('element') or params.get('id')
+        return self.TOP if frame is None else frame
+
+    def before_command(self, name, params):
+        if name == 'switchToFrame':
+            if self._target(params) == self.TOP and self.context is not None and self.frame == self.TOP:
+                self.skipped_switches += 1
+                return True
+            self.switches += 1
+            self.frame = None
+        elif name == 'setContext':
+            self.context = None
+            self.frame = None
+        elif name in ('newSession', 'deleteSession'):
+            self.reset()
+        elif name not in self.READ_ONLY_COMMANDS:
+            # scripts and other commands may navigate or switch frames behind our back
+            self.frame = None
+
+    def after_command(self, name, params, result, error, duration):
+        if error is not None:
+            return
+        if name == 'switchToFrame':
+            self.frame = self._target(params)
+        elif name == 'setContext':
+            self.context = params.get('value')
+        elif name == 'getContext' and isinstance(result, basestring):
+            self.context = result
+        elif name == 'newSession':
+            # new sessions start at the top level frame of the content context
+            self.context = self.marionette.CONTEXT_CONTENT
+            self.frame = self.TOP
+
+
+class AppRegistry(object):
+    """Caches the installed, running and displayed apps of a Marionette session.
+
+    The gaia_apps atom counts the window manager and app install events which
+    change each kind of app. The registry listens to the session's
+    :class:`CommandHooks`: while only read-only commands are sent, the cached
+    apps are returned without asking the device. Otherwise one script reads
+    the counts, returning the apps too if the count of their kind changed.
+    :class:`GaiaApps` calls :meth:`invalidate` when launching, killing,
+    installing or uninstalling apps.
+    """
+
+    _registries = weakref.WeakKeyDictionary()
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        self.session_id = marionette.session_id
+        self.state = {}
+        self.cache = {}
+        # whether a command which could change the apps was sent since the counts were read
+        self.stale = True
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get(cls, marionette):
+        """Returns the registry of the current session of marionette."""
+        registry = cls._registries.get(marionette)
+        if registry is None or registry.session_id != marionette.session_id:
+            hooks = CommandHooks.get(marionette)
+            if registry is not None:
+                hooks.remove(registry)
+            registry = cls._registries[marionette] = cls(marionette)
+            hooks.add(registry)
+        return registry
+
+    def before_command(self, name, params):
+        if name not in FrameTracker.READ_ONLY_COMMANDS:
+            self.stale = True
+
+    def invalidate(self, *kinds):
+        """Forget the cached apps of the given kinds, or all of them.
+
+        :param kinds: any of 'installed', 'running' and 'displayed'.
+        """
+        for key in self.cache.keys():
+            if not kinds or key[0] in kinds:
+                del self.cache[key]
+
+    def cached(self, kind, *args):
+        """Returns the cached apps of a kind if they are known to be current, or None."""
+        cached = self.cache.get((kind,) + args)
+        if cached is None or self.stale:
+            return None
+        return cached[1]
+
+    def lookup(self, kind, wrap, *args):
+        """Returns the apps of a kind, fetching them and calling wrap on them if they changed.
+
+        Must be called from the top level frame of the content context.
+
+        :param kind: 'installed', 'running' or 'displayed'.
+        :param args: arguments of the fetch, cached separately, the only one
+         being whether running apps include the system apps.
+        """
+        key = (kind,) + args
+        cached = self.cache.get(key)
+        if cached is not None and not self.stale:
+            self.hits += 1
+            return cached[1]
+        known_id, known_count = cached[0] if cached is not None else (None, None)
+        state = self.marionette.execute_async_script('GaiaApps.getAppState(%s, %s, %s, %s);' % (
+            json.dumps(kind), json.dumps(known_id), json.dumps(known_count), json.dumps(bool(args and args[0]))))
+        apps = state.pop('apps', None)
+        self.state = state
+        self.stale = False
+        # the apps of other kinds are current again, unless their count changed too
+        for other, (count, value) in self.cache.items():
+            if count != self._count(other[0]):
+                del self.cache[other]
+        if apps is None and cached is not None:
+            self.hits += 1
+            self.cache[key] = cached
+            return cached[1]
+        self.misses += 1
+        self.cache[key] = (self._count(kind), wrap(apps))
+        return self.cache[key][1]
+
+    def _count(self, kind):
+        return self.state.get('id'), self.state.get(kind)
+
+
 class GaiaApp(object):
 
     def __init__(self, origin=None, name=None, frame=None, src=None, manifest_url=None, entry_point=None):
@@ -77,8 +393,15 @@ class GaiaApps(object):
 
     def __init__(self, marionette):
         self.marionette = marionette
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_apps.js"))
-        self.marionette.import_script(js)
+        AtomRegistry.get(self.marionette).import_script('gaia_apps.js')
+
+    @property
+    def frame_tracker(self):
+        return FrameTracker.get(self.marionette)
+
+    @property
+    def registry(self):
+        return AppRegistry.get(self.marionette)
 
     def get_permission(self, app_name, permission_name):
         self.marionette.switch_to_frame()
@@ -96,6 +419,7 @@ class GaiaApps(object):
 
     def launch(self, name, manifest_url=None, entry_point=None, switch_to_frame=True, launch_timeout=None):
         self.marionette.switch_to_frame()
+        self.registry.invalidate('running', 'displayed')
         if manifest_url:
             result = self.marionette.execute_async_script("GaiaApps.launchWithManifestURL('%s', %s)"
                                                           % (manifest_url, json.dumps(entry_point)), script_timeout=launch_timeout)
@@ -120,17 +444,31 @@ class GaiaApps(object):
     @property
     def displayed_app(self):
         self.marionette.switch_to_frame()
-        result = self.marionette.execute_script('return GaiaApps.getDisplayedApp();')
-        return GaiaApp(frame=result.get('frame'),
-                       src=result.get('src'),
-                       name=result.get('name'),
-                       origin=result.get('origin'),
-                       manifest_url=result.get('manifestURL'),
-                       entry_point=result.get('entryPoint'))
+        return self.registry.lookup('displayed', self._wrap_displayed_app)
+
+    def _wrap_displayed_app(self, app):
+        return GaiaApp(frame=app.get('frame'),
+                       src=app.get('src'),
+                       name=app.get('name'),
+                       origin=app.get('origin'),
+                       manifest_url=app.get('manifestURL'),
+                       entry_point=app.get('entryPoint'))
 
     def switch_to_displayed_app(self):
+        app = self.registry.cached('displayed')
+        tracker = self.frame_tracker
+        if (app is not None and tracker is not None and
+                tracker.context == self.marionette.CONTEXT_CONTENT and tracker.frame == app.frame.id):
+            self.registry.hits += 1
+            return
         self.marionette.switch_to_default_content()
-        self.marionette.switch_to_frame(self.displayed_app.frame)
+        try:
+            self.marionette.switch_to_frame(self.displayed_app.frame)
+        except (NoSuchElementException, NoSuchFrameException, StaleElementException):
+            # the frame was replaced without us noticing
+            self.registry.invalidate('displayed')
+            self.marionette.switch_to_default_content()
+            self.marionette.switch_to_frame(self.displayed_app.frame)
 
     def is_app_installed(self, app_name):
         self.marionette.switch_to_frame()
@@ -138,9 +476,11 @@ class GaiaApps(object):
 
     def kill(self, app):
         self.marionette.switch_to_frame()
+        self.registry.invalidate('running', 'displayed')
         result = self.marionette.execute_async_script("GaiaApps.kill('%s');" % app.origin)
         assert result, "Failed to kill app with name '%s'" % app.name
-        # Workaround for bug 1219971, launch an app directly after a kill fails sometimes
+        # Workaround for bug 1219971, launch an app directly after a kill fails sometimes.
+        # The screen being still says nothing about the app being gone, so keep the delay.
         time.sleep(0.5)
 
     def kill_all(self):
@@ -152,8 +492,10 @@ class GaiaApps(object):
 
         # Now kill the user apps
         self.marionette.switch_to_frame()
+        self.registry.invalidate('running', 'displayed')
         self.marionette.execute_async_script("GaiaApps.killAll();")
-        # Workaround for bug 1219971, launch an app directly after a kill fails sometimes
+        # Workaround for bug 1219971, launch an app directly after a kill fails sometimes.
+        # The screen being still says nothing about the app being gone, so keep the delay.
         time.sleep(0.5)
 
     def install(self,manifest_url):
@@ -170,14 +512,17 @@ class GaiaApps(object):
         data_layer = GaiaData(self.marionette)
         preference_action = desired_action.rstrip('Package')
         data_layer.set_bool_pref('dom.mozApps.auto_confirm_{}'.format(preference_action), True)
+        self.registry.invalidate('installed')
         result = self.marionette.execute_async_script('GaiaApps.{}("{}");'.format(desired_action, manifest_url))
         assert (result is True), 'Failed to {} app: {}'.format(desired_action, manifest_url)
         data_layer.set_bool_pref('dom.mozApps.auto_confirm_{}'.format(preference_action), False)
 
     @property
     def installed_apps(self):
-        apps = self.marionette.execute_async_script(
-            'return GaiaApps.getInstalledApps();')
+        self.marionette.switch_to_frame()
+        return list(self.registry.lookup('installed', self._wrap_installed_apps))
+
+    def _wrap_installed_apps(self, apps):
         result = []
         for app in [a for a in apps if not a['manifest'].get('role')]:
             entry_points = app['manifest'].get('entry_points')
@@ -201,10 +546,10 @@ class GaiaApps(object):
         Returns:
             A list of GaiaApp objects representing the running apps.
         '''
-        include_system_apps = json.dumps(include_system_apps)
         self.marionette.switch_to_frame()
-        apps = self.marionette.execute_script(
-            "return GaiaApps.getRunningApps(%s);" % include_system_apps)
+        return list(self.registry.lookup('running', self._wrap_running_apps, bool(include_system_apps)))
+
+    def _wrap_running_apps(self, apps):
         result = []
         for app in [a[1] for a in apps.items()]:
             # Browser app can have no manifest when url is visited
@@ -220,14 +565,12 @@ class GaiaData(object):
     def __init__(self, marionette, testvars=None):
         self.marionette = marionette
         self.testvars = testvars or {}
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_data_layer.js"))
-        self.marionette.import_script(js)
+        atoms = AtomRegistry.get(self.marionette)
+        atoms.import_script('gaia_data_layer.js')
 
         # TODO Bugs 1043562/1049489 To perform ContactsAPI scripts from the chrome context, we need
         # to import the js file into chrome context too
-        self.marionette.set_context(self.marionette.CONTEXT_CHROME)
-        self.marionette.import_script(js)
-        self.marionette.set_context(self.marionette.CONTEXT_CONTENT)
+        atoms.import_script('gaia_data_layer.js', self.marionette.CONTEXT_CHROME)
 
     def set_time(self, date_number):
         self.marionette.set_context(self.marionette.CONTEXT_CHROME)
@@ -245,6 +588,17 @@ class GaiaData(object):
         self.marionette.push_permission('contacts-read', False)
         return result
 
+    @property
+    def contacts_count(self):
+        self.marionette.switch_to_frame()
+        # TODO Bug 1049489 - In future, simplify executing scripts from the chrome context
+        self.marionette.push_permission('contacts-read', True)
+        self.marionette.set_context(self.marionette.CONTEXT_CHROME)
+        result = self.marionette.execute_async_script('return GaiaDataLayer.getContactsCount();')
+        self.marionette.set_context(self.marionette.CONTEXT_CONTENT)
+        self.marionette.push_permission('contacts-read', False)
+        return result
+
     @property
     def sim_contacts(self):
         self.marionette.switch_to_frame()
@@ -263,6 +617,64 @@ class GaiaData(object):
         self.marionette.set_context(self.marionette.CONTEXT_CONTENT)
         self.marionette.push_permission('contacts-create', False)
 
+    def insert_contacts(self, contacts, chunk_size=100):
+        """Inserts a list of contacts, sending chunk_size of them to the device at a time."""
+        inserted = 0
+        for inserted in self.insert_contacts_iter(contacts, chunk_size):
+            pass
+        assert inserted == len(contacts), 'Unable to insert %d of %d contacts' % (
+            len(contacts) - inserted, len(contacts))
+
+    def insert_contacts_iter(self, contacts, chunk_size=100):
+        """Inserts contacts from any iterable, such as a generator, in chunks.
+
+        :param contacts: iterable of :class:`MockContact` objects.
+        :param chunk_size: number of contacts saved on the device by a single script.
+        :returns: generator yielding the total number of contacts inserted after each chunk.
+        """
+        self.marionette.switch_to_frame()
+        # TODO Bug 1049489 - In future, simplify executing scripts from the chrome context
+        self.marionette.push_permission('contacts-create', True)
+        try:
+            for inserted in self._insert_iter(
+                    (c.create_mozcontact() for c in contacts), chunk_size,
+                    'return GaiaDataLayer.insertContacts(%s);', 'contacts',
+                    context=self.marionette.CONTEXT_CHROME):
+                yield inserted
+        finally:
+            self.marionette.push_permission('contacts-create', False)
+
+    def _insert_iter(self, items, chunk_size, script, description, context=None):
+        """Runs script once for every chunk of items, the chunk being passed as JSON.
+
+        The script must return the number of items it inserted. It is run in the
+        current context unless another context is given.
+
+        :returns: generator yielding the total number of items inserted after each chunk.
+        """
+        logger = mozlog.structured.get_default_logger() or mozlog.unstructured.getLogger('gaiatest')
+        start = time.time()
+        inserted = 0
+        items = iter(items)
+        try:
+            while True:
+                chunk = list(itertools.islice(items, chunk_size))
+                if not chunk:
+                    break
+                timeout = max(self.marionette.timeout or 60000, 1000 * len(chunk))
+                if context:
+                    with self.marionette.using_context(context):
+                        inserted += self.marionette.execute_async_script(
+                            script % json.dumps(chunk), script_timeout=timeout)
+                else:
+                    inserted += self.marionette.execute_async_script(
+                        script % json.dumps(chunk), script_timeout=timeout)
+                yield inserted
+        finally:
+            elapsed = time.time() - start
+            logger.info('Inserted %d %s in %.1fs (%.1f %s/s)' % (
+                inserted, description, elapsed, inserted / elapsed if elapsed else 0, description))
+
     def insert_sim_contact(self, contact, contact_type='adn'):
         self.marionette.switch_to_frame()
         mozcontact = contact.create_mozcontact()
@@ -282,9 +694,7 @@ class GaiaData(object):
         # TODO Bug 1049489 - In future, simplify executing scripts from the chrome context
         self.marionette.push_permission('contacts-write', True)
         self.marionette.set_context(self.marionette.CONTEXT_CHROME)
-        timeout = max(self.marionette.timeout or 60000, 1000 * len(self.all_contacts))
-        self.marionette.push_permission('contacts-read', True)
-        result = self.marionette.execute_async_script('return GaiaDataLayer.removeAllContacts();', script_timeout=timeout)
+        result = self.marionette.execute_async_script('return GaiaDataLayer.removeAllContacts();')
         assert result, 'Unable to remove all contacts'
         self.marionette.set_context(self.marionette.CONTEXT_CONTENT)
 
@@ -294,6 +704,13 @@ class GaiaData(object):
         return self.marionette.execute_async_script(
             'return GaiaDataLayer.getSetting("%s")' % name)
 
+    def get_settings(self, names):
+        """Returns a dictionary of the values of the named settings, read in a single lock."""
+        self.marionette.push_permission('settings-read', True)
+        self.marionette.push_permission('settings-api-read', True)
+        return self.marionette.execute_async_script(
+            'return GaiaDataLayer.getSettings(%s)' % json.dumps(list(names)))
+
     @property
     def all_settings(self):
         return self.get_setting('*')
@@ -306,6 +723,14 @@ class GaiaData(object):
         result = self.marionette.execute_async_script('return GaiaDataLayer.setSetting("%s", %s)' % (name, value))
         assert result, "Unable to change setting with name '%s' to '%s'" % (name, value)
 
+    def set_settings(self, settings):
+        """Sets several Gaia settings at once, using a single settings lock."""
+        self.marionette.push_permission('settings-write', True)
+        self.marionette.push_permission('settings-api-write', True)
+        result = self.marionette.execute_async_script(
+            'return GaiaDataLayer.setSettings(%s)' % json.dumps(settings))
+        assert result, "Unable to change settings '%s'" % ', '.join(settings.keys())
+
     def _get_pref(self, datatype, name):
         self.marionette.switch_to_frame()
         with self.marionette.using_context('chrome'):
@@ -319,6 +744,27 @@ class GaiaData(object):
             self.marionette.execute_script(
                 "Services.prefs.set%sPref('%s', %s);" % (datatype, name, value))
 
+    def set_prefs(self, prefs):
+        """Sets several Gecko prefs at once, which are different from Gaia settings.
+
+        The type of each pref is derived from its value in the same way as
+        :meth:`GaiaTestCase.cleanup_gaia` always has: integers are set as integer
+        prefs, booleans as boolean prefs and anything else as a string pref.
+        """
+        typed_prefs = []
+        for name, value in prefs.items():
+            if type(value) is int:
+                datatype = 'Int'
+            elif type(value) is bool:
+                datatype = 'Bool'
+            else:
+                datatype = 'Char'
+            typed_prefs.append([datatype, name, value])
+        self.marionette.switch_to_frame()
+        with self.marionette.using_context('chrome'):
+            self.marionette.execute_script(
+                'return GaiaDataLayer.setPrefs(%s);' % json.dumps(typed_prefs))
+
     def clear_user_pref(self, name):
         self.marionette.switch_to_frame()
         with self.marionette.using_context('chrome'):
@@ -351,8 +797,7 @@ class GaiaData(object):
 
     def set_volume(self, value):
         channels = ['alarm', 'content', 'notification']
-        for channel in channels:
-            self.set_setting('audio.volume.%s' % channel, value)
+        self.set_settings(dict(('audio.volume.%s' % channel, value) for channel in channels))
 
     def bluetooth_enable(self):
         return self.marionette.execute_async_script("return GaiaDataLayer.enableBluetooth()")
@@ -436,6 +881,44 @@ class GaiaData(object):
             'return GaiaDataLayer.getKnownNetworks()')
         return [n for n in known_networks if n]
 
+    def get_state_snapshot(self, setting_names, include_networks=True):
+        """Returns a snapshot of the device state that is reset by cleanup_gaia.
+
+        :param setting_names: names of the settings to record.
+        :param include_networks: record the SSIDs of the known WiFi networks.
+        :returns: dictionary with the recorded ``settings``, the number of
+            ``contacts``, the ``known_networks`` and a ``digest`` of all of them.
+        """
+        state = {
+            'settings': self.get_settings(setting_names),
+            'contacts': self.contacts_count,
+            'known_networks': []}
+        if include_networks:
+            self.marionette.switch_to_frame()
+            state['known_networks'] = sorted(n.get('ssid') for n in self.known_networks)
+        state['digest'] = self.state_digest(state)
+        return state
+
+    @staticmethod
+    def state_digest(state):
+        """Returns a digest of a state snapshot, ignoring any existing digest."""
+        state = dict((k, v) for k, v in state.items() if k != 'digest')
+        return hashlib.sha1(json.dumps(state, sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def changed_settings(state, settings):
+        """Returns the subset of settings whose values differ from a state snapshot.
+
+        Settings that were not recorded in the snapshot are always included.
+        """
+        recorded = state.get('settings', {})
+        changed = {}
+        for name, value in settings.items():
+            # round trip through JSON so that we compare values as the device stores them
+            if name not in recorded or json.loads(json.dumps(value)) != recorded[name]:
+                changed[name] = value
+        return changed
+
     @property
     def active_telephony_state(self):
         # Returns the state of only the currently active call or None if no active call
@@ -479,6 +962,27 @@ class GaiaData(object):
         self.clear_user_pref('dom.sms.enabled')
         return result
 
+    def insert_sms(self, messages, chunk_size=100):
+        """Inserts a list of messages directly into the message database, without sending them."""
+        inserted = 0
+        for inserted in self.insert_sms_iter(messages, chunk_size):
+            pass
+        assert inserted == len(messages), 'Unable to insert %d of %d sms messages' % (
+            len(messages) - inserted, len(messages))
+
+    def insert_sms_iter(self, messages, chunk_size=100):
+        """Inserts messages from any iterable, such as :func:`generate_sms`, in chunks.
+
+        Messages are threaded by the message database according to their participant.
+
+        :param messages: iterable of :class:`MockSms` objects.
+        :param chunk_size: number of messages saved on the device by a single script.
+        :returns: generator yielding the total number of messages inserted after each chunk.
+        """
+        self.marionette.switch_to_frame()
+        return self._insert_iter(messages, chunk_size, 'return GaiaDataLayer.insertSms(%s);',
+                                 'sms messages', context=self.marionette.CONTEXT_CHROME)
+
     def delete_all_call_log_entries(self):
         """The call log needs to be open and focused in order for this to work."""
         self.marionette.execute_script('window.wrappedJSObject.RecentsDBManager.deleteAll();')
@@ -487,9 +991,23 @@ class GaiaData(object):
         """The call log needs to be open and focused in order for this to work."""
         self.marionette.execute_script('window.wrappedJSObject.CallLogDBManager.add(%s);' % (json.dumps(call)))
 
-        # TODO Replace with proper wait when possible
-        import time
-        time.sleep(1)
+        # wait for the call log to display the new entry
+        SettleDetector(self.marionette).wait(1)
+
+    def insert_call_entries(self, calls, chunk_size=100):
+        """Inserts a list of calls, such as from :func:`generate_calls`, into the call log.
+
+        The call log needs to be open and focused in order for this to work.
+        """
+        inserted = 0
+        for inserted in self._insert_iter(calls, chunk_size, 'return GaiaDataLayer.insertCallEntries(%s);',
+                                          'call log entries'):
+            pass
+        assert inserted == len(calls), 'Unable to insert %d of %d call log entries' % (
+            len(calls) - inserted, len(calls))
+
+        # wait for the call log to display the new entries
+        SettleDetector(self.marionette).wait(1)
 
     def kill_active_call(self):
         self.marionette.execute_script("var telephony = window.navigator.mozTelephony; " +
@@ -552,6 +1070,147 @@ class GaiaData(object):
         return self.marionette.execute_script("return window.wrappedJSObject.Service.query('currentChannel');")
 
 
+class SettleDetector(object):
+    """Waits for the screen to stop changing, instead of sleeping for a fixed time."""
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+
+    def wait(self, timeout, interval=0.05, stable_frames=3, min_wait=None):
+        """Returns once the screen content is unchanged for stable_frames consecutive samples.
+
+        Right after a gesture the screen may not have started changing yet, so
+        an unchanged screen only counts as settled once it has been seen to
+        change, or after min_wait.
+
+        :param timeout: maximum time to wait in seconds, typically the length of the sleep replaced.
+        :param interval: time between two samples of the screen in seconds.
+        :param stable_frames: number of consecutive identical samples required.
+        :param min_wait: time in seconds after which a screen that never changed is settled,
+            a quarter of timeout by default.
+        :returns: True if the screen settled, False if it was still changing after timeout.
+        """
+        if timeout <= 0:
+            return True
+        if min_wait is None:
+            min_wait = timeout / 4.0
+        AtomRegistry.get(self.marionette).import_script('gaia_settle.js', self.marionette.CONTEXT_CHROME)
+        with self.marionette.using_context(self.marionette.CONTEXT_CHROME):
+            return self.marionette.execute_async_script(
+                'GaiaSettle.waitForStableFrames(%d, %d, %d, %d);' % (
+                    interval * 1000, timeout * 1000, stable_frames, min_wait * 1000),
+                script_timeout=int(timeout * 1000) + 10000)
+
+
+class ElementSnapshot(object):
+    """The state of an element when a snapshot was taken.
+
+    Holds the element, so it can still be acted upon, but reading the
+    snapshot costs no round trip, except for whether the element is
+    displayed which is asked to Marionette the first time it is read.
+    """
+
+    __slots__ = ('element', 'text', '_displayed', 'rect', 'attributes')
+
+    def __init__(self, element, text, rect, attributes, displayed=None):
+        self.element = element
+        self.text = text
+        self._displayed = displayed
+        self.rect = rect
+        self.attributes = attributes
+
+    @property
+    def displayed(self):
+        if self._displayed is None:
+            self._displayed = self.element.is_displayed()
+        return self._displayed
+
+    def get_attribute(self, name):
+        return self.attributes.get(name)
+
+
+class ElementProbe(object):
+    """Finds out whether elements are present and displayed without waiting for them.
+
+    Any number of locators are checked by a single script, instead of a round
+    trip to disable the search timeout, one per element looked up and one to
+    restore the timeout. Whether the elements found are displayed is asked to
+    Marionette, whose rules are not worth copying.
+    """
+
+    # locator strategies the gaia_probe atom can use, others are looked up through Marionette
+    STRATEGIES = ('id', 'css selector', 'class name', 'name', 'tag name', 'xpath',
+                  'link text', 'partial link text')
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        # the probe may be used in either context, such as by the system app in chrome
+        atoms = AtomRegistry.get(self.marionette)
+        atoms.import_script('gaia_probe.js')
+        atoms.import_script('gaia_probe.js', self.marionette.CONTEXT_CHROME)
+
+    def probe(self, *locators):
+        """Returns a dictionary for each (by, value) locator of the current frame.
+
+        Each dictionary tells whether an element matching the locator is
+        ``present`` and ``displayed``, with the ``element`` and its ``rect``
+        if it is present.
+        """
+        results = self._find(locators)
+        for result in results:
+            result['displayed'] = result['present'] and result['element'].is_displayed()
+        return results
+
+    def _find(self, locators):
+        results = [None] * len(locators)
+        supported = [i for i, (by, value) in enumerate(locators) if by in self.STRATEGIES]
+        if supported:
+            probed = self.marionette.execute_script(
+                'return GaiaProbe.probe(arguments[0]);',
+                [[list(locators[i]) for i in supported]])
+            for i, result in zip(supported, probed):
+                results[i] = result
+        for i, locator in enumerate(locators):
+            if results[i] is None:
+                results[i] = self._probe_with_marionette(*locator)
+        return results
+
+    def snapshot(self, by, value, attributes=(), root=None):
+        """Returns an :class:`ElementSnapshot` of each element matching a locator.
+
+        :param by: locator strategy.
+        :param value: locator value.
+        :param attributes: names of the attributes to record.
+        :param root: element to search within, the document of the current frame by default.
+        """
+        attributes = list(attributes)
+        if by not in self.STRATEGIES:
+            parent = root or self.marionette
+            return [ElementSnapshot(element, element.text, element.rect,
+                                    dict((name, element.get_attribute(name)) for name in attributes))
+                    for element in parent.find_elements(by, value)]
+        results = self.marionette.execute_script(
+            'return GaiaProbe.snapshot(arguments[0], arguments[1], arguments[2], arguments[3]);',
+            [by, value, attributes, root])
+        return [ElementSnapshot(r['element'], r['text'], r['rect'], r['attributes']) for r in results]
+
+    def _probe_with_marionette(self, by, value):
+        self.marionette.set_search_timeout(0)
+        try:
+            element = self.marionette.find_element(by, value)
+            return {'present': True, 'rect': element.rect, 'element': element}
+        except NoSuchElementException:
+            return {'present': False, 'rect': None, 'element': None}
+        finally:
+            self.marionette.set_search_timeout(self.marionette.timeout or 10000)
+
+    def is_present(self, by, value):
+        return self._find([(by, value)])[0]['present']
+
+    def is_displayed(self, by, value):
+        return self.probe((by, value))[0]['displayed']
+
+
 class Accessibility(object):
 
     def __init__(self, marionette):
@@ -597,10 +1256,7 @@ class Accessibility(object):
             "window.dispatchEvent(new CustomEvent('accessibility-action'));")
 
     def execute_async_script(self, script, args, **kwargs):
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir,
-                                          'atoms', "accessibility.js"))
-        with open(js, 'r') as f:
-            content = f.read()
+        content = AtomRegistry.source('accessibility.js')[0]
 
         kwargs['sandbox'] = 'system'
         result = self.marionette.execute_async_script(
@@ -638,8 +1294,7 @@ class GaiaDevice(object):
             # Use the device root for storage
             self.storage_path = self.manager.deviceRoot
 
-        self.lockscreen_atom = os.path.abspath(
-            os.path.join(__file__, os.path.pardir, 'atoms', "gaia_lock_screen.js"))
+        self.lockscreen_atom = AtomRegistry.path('gaia_lock_screen.js')
 
     def _set_storage_path(self):
         if self.is_desktop_b2g:
@@ -800,7 +1455,7 @@ class GaiaDevice(object):
         self.marionette.execute_script("window.wrappedJSObject.dispatchEvent(new Event('holdhome'));")
         # This is for the opacity animation to be finished for the task-manager
         # Otherwise we get intermittent issues tapping on opening a new browser window
-        time.sleep(0.3)
+        SettleDetector(self.marionette).wait(0.3)
 
     def hold_sleep_button(self):
         self.marionette.switch_to_frame()
@@ -824,7 +1479,7 @@ class GaiaDevice(object):
 
     def unlock(self):
         if self.is_locked:
-            self.marionette.import_script(self.lockscreen_atom)
+            AtomRegistry.get(self.marionette).import_script('gaia_lock_screen.js')
             self.marionette.switch_to_frame()
             result = self.marionette.execute_async_script("GaiaLockScreen.unlock();", sandbox='default')
             GaiaData(self.marionette).set_setting('lockscreen.enabled', False)
@@ -862,8 +1517,23 @@ class GaiaDevice(object):
 
 
 class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
+
+    # snapshot of the device state taken at the end of the previous test, and
+    # digest of the state right after a full reset, only recorded when running
+    # with --differential-cleanup
+    _device_state = None
+    _clean_state_digest = None
+
     def __init__(self, *args, **kwargs):
         self.restart = kwargs.pop('restart', False)
+        self.differential_cleanup = kwargs.pop('differential_cleanup', False)
+        self.trace_commands = kwargs.pop('trace_commands', False)
+        # maximum number of Marionette commands the test may send, from the manifest
+        self.max_roundtrips = kwargs.pop('max_roundtrips', None)
+        self.command_tracer = None
+        # file the time spent in each phase of the tests is reported to at the end of the run
+        self.phase_report = kwargs.pop('phase_report', None)
+        self.phase_timer = PhaseTimer()
         self.locale = kwargs.pop('locale')
         self.capture = kwargs.pop('capture')
         self.capturefolder = kwargs.pop('capturefolder')
@@ -871,11 +1541,19 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
         B2GTestCaseMixin.__init__(self, *args, **kwargs)
 
     def setUp(self):
-        try:
-            MarionetteTestCase.setUp(self)
-        except IOError:
-            if self.restart:
-                pass
+        self.phase_timer = PhaseTimer()
+        with self.phase('setUp'):
+            self._setUp()
+        self.phase_timer.start('test')
+
+    def _setUp(self):
+        with self.phase('marionette'):
+            try:
+                MarionetteTestCase.setUp(self)
+            except IOError:
+                if self.restart:
+                    pass
+        FrameTracker.install(self.marionette)
 
         self.environment = GaiaTestEnvironment(self.testvars)
         self.device = GaiaDevice(self.marionette,
@@ -884,14 +1562,19 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
 
         if self.restart and (self.device.is_android_build or self.marionette.instance):
             # Restart if it's a device, or we have passed a binary instance with --binary command arg
-            self.device.stop_b2g()
-            try:
-                if self.device.is_android_build:
-                    self.cleanup_data()
-                self.set_default_settings()
-            finally:
-                # make sure we restart to avoid leaving us in a bad state
-                self.device.start_b2g()
+            with self.phase('restart'):
+                with self.phase('stop_b2g'):
+                    self.device.stop_b2g()
+                try:
+                    if self.device.is_android_build:
+                        with self.phase('cleanup_data'):
+                            self.cleanup_data()
+                    with self.phase('set_default_settings'):
+                        self.set_default_settings()
+                finally:
+                    # make sure we restart to avoid leaving us in a bad state
+                    with self.phase('start_b2g'):
+                        self.device.start_b2g()
 
         # We need to set the default timeouts because we may have a new session
         if self.marionette.timeout is None:
@@ -927,15 +1610,49 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
         self.data_layer = GaiaData(self.marionette, self.testvars)
         self.accessibility = Accessibility(self.marionette)
 
-        self.cleanup_storage()
+        with self.phase('cleanup_storage'):
+            self.cleanup_storage()
+
+        # a recorded state is only valid for the test immediately following it
+        previous_state, GaiaTestCase._device_state = GaiaTestCase._device_state, None
 
         if self.restart:
             self.cleanup_gaia(full_reset=False)
         else:
-            self.cleanup_gaia(full_reset=True)
+            self.cleanup_gaia(full_reset=True, previous_state=previous_state)
 
         if self.capture != "off":
-            self.start_video_capture()
+            with self.phase('video_capture'):
+                self.start_video_capture()
+
+        if self.trace_commands or self.max_roundtrips:
+            self.start_command_tracing()
+
+    def start_command_tracing(self):
+        """Record every Marionette command sent until the test ends."""
+        tracker = FrameTracker.get(self.marionette)
+        self.command_tracer = CommandTracer(tracker.context if tracker is not None else None)
+        CommandHooks.get(self.marionette).add(self.command_tracer)
+
+    def stop_command_tracing(self):
+        """Stop recording commands and log a summary of them, which is returned."""
+        CommandHooks.get(self.marionette).remove(self.command_tracer)
+        summary = self.command_tracer.summary()
+        self.command_tracer = None
+        self.logger.test_status(self.id(), 'marionette_commands', 'PASS', extra=summary)
+        return summary
+
+    def phase(self, name):
+        """Context manager timing a phase of the test, phases may be nested."""
+        return self.phase_timer.phase(name)
+
+    def report_phases(self):
+        """Add the durations of the phases of this test to the totals of the run."""
+        durations = self.phase_timer.durations()
+        PhaseTimer.add_totals(durations)
+        if self.phase_report:
+            self.logger.test_status(self.id(), 'phases', 'PASS',
+                                    extra=dict((name, int(duration * 1000)) for name, duration in durations))
 
     # saves the captured video in /sdcard/ folder (only logical choice)
     # triggers screenrecord command as a thread since the command is blocking the main thread
@@ -966,27 +1683,32 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
                                     os.path.join(self.capturefolder, self.video_capture_filename))
 
     def cleanup_data(self):
-        self.device.file_manager.remove('/cache/*')
-        self.device.file_manager.remove('/data/b2g/mozilla')
-        self.device.file_manager.remove('/data/local/debug_info_trigger')
-        self.device.file_manager.remove('/data/local/indexedDB')
-        self.device.file_manager.remove('/data/local/OfflineCache')
-        self.device.file_manager.remove('/data/local/permissions.sqlite')
-        self.device.file_manager.remove('/data/local/storage/permanent')
-        self.device.file_manager.remove('/data/local/storage/persistent')
-        self.device.file_manager.remove('/data/local/storage/default')
-        # remove remembered networks
-        self.device.file_manager.remove('/data/misc/wifi/wpa_supplicant.conf')
+        removed = self.device.file_manager.remove_many([
+            '/cache/*',
+            '/data/b2g/mozilla',
+            '/data/local/debug_info_trigger',
+            '/data/local/indexedDB',
+            '/data/local/OfflineCache',
+            '/data/local/permissions.sqlite',
+            '/data/local/storage/permanent',
+            '/data/local/storage/persistent',
+            '/data/local/storage/default',
+            # remove remembered networks
+            '/data/misc/wifi/wpa_supplicant.conf'], glob_children=False)
 
         if self.device.is_android_build:
             apps = json.loads(self.device.file_manager.pull_file('/data/local/webapps/webapps.json'))
             system_install_time = apps['system.gaiamobile.org']['installTime']
+            paths = []
             for app in apps.values():
                 if app.get('installTime') > system_install_time:
                     # removing any webapps installed since build time
                     path = posixpath.join(app.get('basePath'), app.get('id'))
                     self.logger.debug('Removing %s' % path)
-                    self.device.file_manager.remove(path)
+                    paths.append(path)
+            if paths:
+                removed += self.device.file_manager.remove_many(paths, glob_children=False)
+        self.logger.info('Removed %d entries of data' % removed)
 
     def cleanup_storage(self):
         """Remove all files from the device's storage paths"""
@@ -998,57 +1720,110 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
                                   '/storage/sdcard/',
                                   '/storage/sdcard0/',
                                   '/storage/sdcard1/'])
-        for path in storage_paths:
-            if self.device.file_manager.dir_exists(path):
-                for item in self.device.file_manager.list_items(path):
-                    self.device.file_manager.remove('/'.join([path, item]))
+        removed = self.device.file_manager.remove_many(storage_paths)
+        self.logger.info('Removed %d entries from storage' % removed)
 
-    def cleanup_gaia(self, full_reset=True):
+    def cleanup_gaia(self, full_reset=True, previous_state=None):
+        """Reset Gaia to a known state.
 
-        self.device.turn_screen_off()
-        self.device.turn_screen_on()
+        :param full_reset: also reset settings, network connections and contacts.
+        :param previous_state: snapshot returned by :meth:`GaiaData.get_state_snapshot`
+            at the end of the previous test. When given, only the parts of the
+            state that differ from the defaults are reset.
+        """
+
+        with self.phase('cleanup_gaia'):
+            self._cleanup_gaia(full_reset, previous_state)
+
+    def _cleanup_gaia(self, full_reset, previous_state):
+        with self.phase('screen'):
+            self.device.turn_screen_off()
+            self.device.turn_screen_on()
 
         # kill the FTU and any open, user-killable apps
-        self.apps.kill_all()
+        with self.phase('kill_all'):
+            self.apps.kill_all()
 
-        default_prefs = DEFAULT_PREFS.copy()
-        default_prefs.update(self.testvars.get('prefs', {}))
-        default_prefs = self.modify_prefs(default_prefs)
-        for name, value in default_prefs.items():
-            if type(value) is int:
-                self.data_layer.set_int_pref(name, value)
-            elif type(value) is bool:
-                self.data_layer.set_bool_pref(name, value)
-            else:
-                self.data_layer.set_char_pref(name, value)
+        with self.phase('prefs'):
+            default_prefs = DEFAULT_PREFS.copy()
+            default_prefs.update(self.testvars.get('prefs', {}))
+            default_prefs = self.modify_prefs(default_prefs)
+            self.data_layer.set_prefs(default_prefs)
 
         # unlock
-        if self.data_layer.get_setting('lockscreen.enabled'):
-            self.device.unlock()
+        with self.phase('unlock'):
+            if self.data_layer.get_setting('lockscreen.enabled'):
+                self.device.unlock()
 
         if full_reset:
-            default_settings = DEFAULT_SETTINGS.copy()
-            default_settings.update(self.testvars.get('settings', {}))
-            default_settings = self.modify_settings(default_settings)
-            for name, value in default_settings.items():
-                self.data_layer.set_setting(name, value)
+            if previous_state is not None and previous_state['digest'] == GaiaTestCase._clean_state_digest:
+                # nothing changed since the device was last reset
+                self.logger.debug('Device state %s is unchanged' % previous_state['digest'])
+                with self.phase('home'):
+                    self.device.touch_home_button()
+                return
+
+            default_settings = self._default_settings()
+            reset_wifi = self.device.has_wifi and not self.device.is_emulator
+            if previous_state is None:
+                reset_cell_data = True
+                remove_contacts = True
+            else:
+                self.logger.debug('Resetting changes to device state %s' % previous_state['digest'])
+                default_settings = self.data_layer.changed_settings(previous_state, default_settings)
+                recorded = previous_state['settings']
+                reset_cell_data = recorded.get('ril.data.enabled') is not False
+                reset_wifi = reset_wifi and (recorded.get('wifi.enabled') is not False or
+                                             len(previous_state['known_networks']) > 0)
+                remove_contacts = previous_state['contacts'] != 0
+
+            with self.phase('settings'):
+                if default_settings:
+                    self.data_layer.set_settings(default_settings)
 
             # disable carrier data connection
-            if self.device.has_mobile_connection:
-                self.data_layer.disable_cell_data()
+            with self.phase('cell_data'):
+                if reset_cell_data and self.device.has_mobile_connection:
+                    self.data_layer.disable_cell_data()
 
-            if self.device.has_wifi:
-                # Bug 908553 - B2G Emulator: support wifi emulation
-                if not self.device.is_emulator:
+            # Bug 908553 - B2G Emulator: support wifi emulation
+            with self.phase('wifi'):
+                if reset_wifi:
                     self.data_layer.enable_wifi()
                     self.data_layer.forget_all_networks()
                     self.data_layer.disable_wifi()
 
             # remove data
-            self.data_layer.remove_all_contacts()
+            with self.phase('contacts'):
+                if remove_contacts:
+                    self.data_layer.remove_all_contacts()
 
             # reset to home screen
-            self.device.touch_home_button()
+            with self.phase('home'):
+                self.device.touch_home_button()
+
+            if previous_state is None and self.differential_cleanup:
+                GaiaTestCase._clean_state_digest = None
+                try:
+                    with self.phase('record_state'):
+                        GaiaTestCase._clean_state_digest = self._state_snapshot()['digest']
+                except Exception:
+                    self.logger.warning('Failed to record the reset device state.', exc_info=True)
+
+    def record_state(self):
+        """Record the device state so the next test only resets what has changed."""
+        GaiaTestCase._device_state = self._state_snapshot()
+        self.logger.debug('Recorded device state %s' % GaiaTestCase._device_state['digest'])
+
+    def _state_snapshot(self):
+        names = self._default_settings().keys() + ['ril.data.enabled', 'wifi.enabled']
+        include_networks = self.device.has_wifi and not self.device.is_emulator
+        return self.data_layer.get_state_snapshot(names, include_networks)
+
+    def _default_settings(self):
+        settings = DEFAULT_SETTINGS.copy()
+        settings.update(self.testvars.get('settings', {}))
+        return self.modify_settings(settings)
 
     def connect_to_local_area_network(self):
         if not self.device.is_online:
@@ -1125,9 +1900,7 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
 
     def set_default_settings(self):
         filename = 'settings.json'
-        defaults = DEFAULT_SETTINGS.copy()
-        defaults.update(self.testvars.get('settings', {}))
-        defaults = self.modify_settings(defaults)
+        defaults = self._default_settings()
 
         if self.locale != 'undefined':
                 defaults['language.current'] = self.locale
@@ -1162,20 +1935,41 @@ class GaiaTestCase(MarionetteTestCase, B2GTestCaseMixin):
         return sys.exc_info()[0] is not None
 
     def tearDown(self):
+        self.phase_timer.stop('test')
+        with self.phase('tearDown'):
+            commands = self._tearDown()
+        self.report_phases()
+
+        if commands and self.max_roundtrips and commands['roundtrips'] > int(self.max_roundtrips):
+            self.fail('%d Marionette commands sent, exceeding the budget of %s' % (
+                commands['roundtrips'], self.max_roundtrips))
+
+    def _tearDown(self):
+        commands = self.stop_command_tracing() if self.command_tracer else None
         self.marionette.switch_to_frame()
+        if self.differential_cleanup and not self.restart:
+            try:
+                with self.phase('record_state'):
+                    self.record_state()
+            except Exception:
+                self.logger.warning('Failed to record device state, next test will run a full reset.',
+                                    exc_info=True)
         if self.device.is_desktop_b2g and self.device.storage_path:
             shutil.rmtree(self.device.storage_path, ignore_errors=True)
         self.apps = None
         self.data_layer = None
 
         if self.capture != "off":
-            self.stop_video_capture()
-            # pull video file when there was an exception, or always set to pull
-            if self.capture == "always" or \
-                    (self.capture == "whenfail" and self._has_thrown_any_exception_during_run):
-                self.pull_video_capture()
+            with self.phase('video_capture'):
+                self.stop_video_capture()
+                # pull video file when there was an exception, or always set to pull
+                if self.capture == "always" or \
+                        (self.capture == "whenfail" and self._has_thrown_any_exception_during_run):
+                    self.pull_video_capture()
 
-        MarionetteTestCase.tearDown(self)
+        with self.phase('marionette'):
+            MarionetteTestCase.tearDown(self)
+        return commands
 
 
 class PasscodeTestCase(GaiaTestCase):
@@ -1205,5 +1999,4 @@ class PasscodeTestCase(GaiaTestCase):
         settings[SET_DIGEST_ITERATIONS] = 1000
         settings[SET_DIGEST_ALGORITHM] = 'SHA-1'
 
-        for setting, value in settings.iteritems():
-            self.data_layer.set_setting(setting, value)
+        self.data_layer.set_settings(settings)
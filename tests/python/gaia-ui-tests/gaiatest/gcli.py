@@ -1,15 +1,58 @@
 import argparse
+import json
+import shlex
+import socket
+import StringIO
 import sys
+import threading
 
 from marionette_driver.marionette import Marionette
 
 import gaiatest
 
 
+class CommandLineError(Exception):
+    """An invalid command line, described with the usage of the command."""
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    """Raises the errors of a command line instead of printing them and exiting.
+
+    Commands run by gcli serve are parsed by the server, so their errors
+    must be sent back to the client rather than printed by the server.
+    """
+
+    def error(self, message):
+        raise CommandLineError('%s%s: error: %s' % (self.format_usage(), self.prog, message))
+
+
 class GCli(object):
 
-    def __init__(self):
+    # maximum time in seconds for a client of gcli serve to send its command
+    request_timeout = 10
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.marionette = None
         self.commands = {
+            'batch': {
+                'function': self.batch,
+                'args': [
+                    {'name': 'path',
+                     'help': 'File with one command per line'},
+                    {'name': '--device',
+                     'dest': 'devices',
+                     'action': 'append',
+                     'metavar': 'ADDRESS',
+                     'help': 'Address (host:port) of a device to run the '
+                             'commands on, may be repeated to run them on '
+                             'several devices in parallel (default: '
+                             '--address)'},
+                    {'name': '--keep-going',
+                     'action': 'store_true',
+                     'help': 'Run the remaining commands after a command '
+                             'failed'}],
+                'help': 'Run the commands of a file over a single session'},
             'connectwifi': {
                 'function': self.connect_to_wifi,
                 'args': [
@@ -70,6 +113,15 @@ class GCli(object):
             'screenshot': {
                 'function': self.screenshot,
                 'help': 'Take a screenshot'},
+            'serve': {
+                'function': self.serve,
+                'args': [
+                    {'name': '--listen',
+                     'default': 'localhost:2829',
+                     'help': 'Address (host:port) to listen on for commands '
+                             '(default: %(default)s)'}],
+                'help': 'Keep a session open and run the commands sent '
+                        'with --server'},
             'sendsms': {
                 'function': self.send_sms,
                 'args': [
@@ -103,14 +155,32 @@ class GCli(object):
                 'function': self.wake,
                 'help': 'Wake from sleep mode'}}
 
-        self.parser = argparse.ArgumentParser()
+        self.parser = ArgumentParser()
         self.add_options(self.parser)
         self.add_commands(self.parser)
 
     def run(self, args=sys.argv[1:]):
-        args = self.parser.parse_args()
+        try:
+            parsed = self.parser.parse_args(args)
+            if parsed.func == self.batch and parsed.server and parsed.devices:
+                self.parser.error('batch cannot run the commands on --device with --server')
+        except CommandLineError as e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(2)
+
+        if parsed.func in (self.batch, self.serve):
+            ret = parsed.func(parsed)
+        elif parsed.server:
+            ret = self.send_to_server(parsed.server, args)
+        else:
+            self.connect(parsed.address)
+            ret = parsed.func(parsed)
+            self.disconnect()
+
+        sys.exit(ret or 0)
 
-        host, port = args.address.split(':')
+    def connect(self, address):
+        host, port = address.split(':')
         self.marionette = Marionette(host=host, port=int(port))
         self.marionette.start_session()
 
@@ -118,13 +188,43 @@ class GCli(object):
         self.data_layer = gaiatest.GaiaData(self.marionette)
         self.device = gaiatest.GaiaDevice(self.marionette)
 
-        ret = args.func(args)
-        if ret is None:
-            ret = 0
-
+    def disconnect(self):
         self.marionette.delete_session()
-
-        sys.exit(ret)
+        self.marionette = None
+
+    def execute(self, args):
+        """Runs a command over the current session and returns its exit status."""
+        try:
+            parsed = self.parser.parse_args(args)
+        except CommandLineError as e:
+            self.output(e)
+            return 2
+        except SystemExit as e:
+            # argparse has printed the help
+            return e.code
+        if parsed.func in (self.batch, self.serve):
+            self.output('%s cannot be run over an existing session' % args[0])
+            return 1
+        try:
+            return parsed.func(parsed) or 0
+        except Exception as e:
+            self.output('Error: %s' % e)
+            return 1
+
+    def output(self, text):
+        self.out.write('%s\n' % text)
+
+    def send_to_server(self, server, args):
+        """Runs a command on a gcli server, prints its output and returns its exit status."""
+        host, port = server.split(':')
+        connection = socket.create_connection((host, int(port)))
+        try:
+            connection.sendall(json.dumps({'args': strip_options(args)}) + '\n')
+            response = json.loads(connection.makefile('r').readline())
+        finally:
+            connection.close()
+        self.out.write(response['output'])
+        return response['status']
 
     def add_options(self, parser):
         parser.add_argument(
@@ -132,6 +232,11 @@ class GCli(object):
             default='localhost:2828',
             help='Address (host:port) of running Gecko instance to connect to '
                  '(default: %(default)s)')
+        parser.add_argument(
+            '--server',
+            metavar='ADDRESS',
+            help='Address (host:port) of a gcli server, started with gcli '
+                 'serve, to run the command on instead of connecting to Gecko')
 
     def add_commands(self, parser):
         subparsers = parser.add_subparsers(
@@ -140,10 +245,90 @@ class GCli(object):
             subparser = subparsers.add_parser(name, help=props['help'])
             if props.get('args'):
                 for arg in props['args']:
-                    kwargs = {k: v for k, v in arg.items() if k is not 'name'}
+                    kwargs = {k: v for k, v in arg.items() if k != 'name'}
                     subparser.add_argument(arg['name'], **kwargs)
             subparser.set_defaults(func=props['function'])
 
+    def batch(self, args):
+        with open(args.path) as f:
+            commands = [shlex.split(line, comments=True) for line in f]
+        commands = [command for command in commands if command]
+        if args.server:
+            for command in commands:
+                ret = self.send_to_server(args.server, command)
+                if ret and not args.keep_going:
+                    return ret
+            return 0
+
+        devices = args.devices or [args.address]
+        lock = threading.Lock()
+        results = {}
+
+        def run_on(address):
+            prefix = '[%s] ' % address if len(devices) > 1 else ''
+            out = StringIO.StringIO()
+            cli = GCli(out=out)
+            results[address] = 1
+            try:
+                cli.connect(address)
+            except Exception as e:
+                with lock:
+                    self.output('%sFailed to connect: %s' % (prefix, e))
+                return
+            try:
+                for command in commands:
+                    ret = cli.execute(command)
+                    with lock:
+                        for line in out.getvalue().splitlines():
+                            self.output(prefix + line)
+                    out.truncate(0)
+                    if ret and not args.keep_going:
+                        with lock:
+                            self.output('%sStopped after failure of: %s' % (prefix, ' '.join(command)))
+                        return
+                results[address] = 0
+            finally:
+                cli.disconnect()
+
+        threads = [threading.Thread(target=run_on, args=(address,)) for address in devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return max(results.values())
+
+    def serve(self, args):
+        host, port = args.listen.split(':')
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, int(port)))
+        server.listen(5)
+        self.connect(args.address)
+        self.output('Listening on %s for commands' % args.listen)
+        stdout = self.out
+        try:
+            while True:
+                connection, address = server.accept()
+                # a client which never sends its command must not hold up the others
+                connection.settimeout(self.request_timeout)
+                try:
+                    request = json.loads(connection.makefile('r').readline())
+                    out = self.out = StringIO.StringIO()
+                    try:
+                        status = self.execute(request['args'])
+                    finally:
+                        self.out = stdout
+                    connection.sendall(json.dumps({'output': out.getvalue(), 'status': status}) + '\n')
+                except (IOError, ValueError, KeyError) as e:
+                    self.output('Failed to handle a request from %s: %s' % (address[0], e))
+                finally:
+                    connection.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            self.disconnect()
+
     def connect_to_wifi(self, args):
         network = {
             'ssid': args.ssid,
@@ -164,9 +349,9 @@ class GCli(object):
         self.data_layer.forget_all_networks()
 
     def get_setting(self, args):
-        print '%s: %s' % (
+        self.output('%s: %s' % (
             args.name,
-            self.data_layer.get_setting(args.name))
+            self.data_layer.get_setting(args.name)))
 
     def home(self, args):
         self.device.touch_home_button()
@@ -185,9 +370,9 @@ class GCli(object):
         networks = [n for n in self.data_layer.known_networks if 'ssid' in n]
         if len(networks) > 0:
             for i, network in enumerate(networks):
-                print '%s: %s' % (i + 1, network['ssid'])
+                self.output('%s: %s' % (i + 1, network['ssid']))
         else:
-            print 'No known networks.'
+            self.output('No known networks.')
 
     def launch_app(self, args):
         for name in args.name:
@@ -196,12 +381,12 @@ class GCli(object):
     def list_all_apps(self, args):
         for i, app in enumerate(sorted(self.apps.installed_apps,
                                        key=lambda a: a.name.lower())):
-            print '%d: %s' % (i + 1, app.name)
+            self.output('%d: %s' % (i + 1, app.name))
 
     def list_running_apps(self, args):
-        for i, app in enumerate(sorted(self.apps.running_apps,
+        for i, app in enumerate(sorted(self.apps.running_apps(),
                                        key=lambda a: a.name.lower())):
-            print '%d: %s' % (i + 1, app.name)
+            self.output('%d: %s' % (i + 1, app.name))
 
     def lock(self, args):
         self.device.lock()
@@ -233,6 +418,14 @@ class GCli(object):
             "window.wrappedJSObject.dispatchEvent(new Event('wake'));")
 
 
+def strip_options(args):
+    """Returns the command and its arguments, without the options of gcli itself."""
+    args = list(args)
+    while args and args[0].split('=')[0] in ('--address', '--server'):
+        args = args[1:] if '=' in args[0] else args[2:]
+    return args
+
+
 def cli(args=sys.argv[1:]):
     cli = GCli()
     cli.run(args)
@@ -0,0 +1,195 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from email.utils import formatdate, mktime_tz, parsedate_tz
+import mimetypes
+import os
+import re
+import SimpleHTTPServer
+import StringIO
+import threading
+
+# size of the chunks files are sent in
+CHUNK_SIZE = 64 * 1024
+
+
+class CachedFile(object):
+    """A file served by the httpd, with its contents if it is small enough to be kept in memory."""
+
+    def __init__(self, path, size, mtime, data=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.data = data
+        self.etag = '"%x-%x"' % (int(mtime * 1000), size)
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    def open(self):
+        if self.data is not None:
+            return StringIO.StringIO(self.data)
+        return open(self.path, 'rb')
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+class FileCache(object):
+    """Caches the files served by the httpd, keyed by their path and modification time.
+
+    :param max_file_size: size in bytes up to which the contents of a file are
+        kept in memory, larger files are read from disk when served.
+    """
+
+    def __init__(self, max_file_size=512 * 1024):
+        self.max_file_size = max_file_size
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the :class:`CachedFile` of path, reading it again if it changed.
+
+        :raises OSError: if the file does not exist.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            cached = self.files.get(path)
+            if cached is not None and (cached.mtime, cached.size) == (stat.st_mtime, stat.st_size):
+                self.hits += 1
+                return cached
+        data = None
+        if stat.st_size <= self.max_file_size:
+            with open(path, 'rb') as f:
+                data = f.read()
+        cached = CachedFile(path, stat.st_size, stat.st_mtime, data)
+        with self._lock:
+            self.files[path] = cached
+            self.misses += 1
+        return cached
+
+
+def validator_headers(cached):
+    return {'ETag': cached.etag, 'Last-Modified': cached.last_modified}
+
+
+def is_not_modified(headers, cached):
+    """Whether the conditional request headers show the client has the current version of the file."""
+    if headers.get('If-None-Match'):
+        tags = [t.strip() for t in headers.get('If-None-Match').split(',')]
+        return '*' in tags or cached.etag in tags
+    since = headers.get('If-Modified-Since')
+    if since:
+        since = parsedate_tz(since)
+        return since is not None and int(cached.mtime) <= mktime_tz(since)
+    return False
+
+
+def requested_range(headers, cached):
+    """Returns the first and last byte of the range requested, None for the whole file.
+
+    :raises ValueError: if the range cannot be satisfied.
+    """
+    header = headers.get('Range')
+    if_range = headers.get('If-Range')
+    if not header or (if_range and if_range not in (cached.etag, cached.last_modified)):
+        return None
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if match is None or match.groups() == ('', ''):
+        # multiple or malformed ranges are answered with the whole file
+        return None
+    first, last = match.groups()
+    if first == '':
+        first, last = max(cached.size - int(last), 0), cached.size - 1
+    else:
+        first, last = int(first), min(int(last), cached.size - 1) if last else cached.size - 1
+    if first > last or first >= cached.size:
+        raise ValueError('Range not satisfiable: %s' % header)
+    return first, last
+
+
+class CachingRequestHandlerMixin:
+    """Serves files through a :class:`FileCache`, answering conditional and range requests.
+
+    Mixed into the request handler of the httpd, in front of
+    :class:`SimpleHTTPServer.SimpleHTTPRequestHandler`. Like it, this is an
+    old style class.
+    """
+
+    file_cache = None
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            # directories and missing files are handled as before
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+        cached = self.file_cache.get(path)
+        self._remaining = None
+
+        if is_not_modified(self.headers, cached):
+            self.send_response(304)
+            for name, value in validator_headers(cached).items():
+                self.send_header(name, value)
+            self.end_headers()
+            return None
+
+        try:
+            byte_range = requested_range(self.headers, cached)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % cached.size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        f = cached.open()
+        if byte_range is None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(cached.size))
+        else:
+            first, last = byte_range
+            f.seek(first)
+            self._remaining = last - first + 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, cached.size))
+            self.send_header('Content-Length', str(self._remaining))
+        self.send_header('Content-Type', cached.content_type)
+        self.send_header('Accept-Ranges', 'bytes')
+        for name, value in validator_headers(cached).items():
+            self.send_header(name, value)
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, '_remaining', None)
+        while remaining is None or remaining > 0:
+            chunk = source.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+
+def http_server(httpd):
+    """Returns the HTTP server of a running MozHttpd, or of the Marionette FixtureServer wrapping one."""
+    return getattr(httpd, '_server', httpd).httpd
+
+
+def install_file_cache(httpd, file_cache):
+    """Make a running mozhttpd server send files through file_cache.
+
+    :param httpd: a MozHttpd, or the Marionette FixtureServer wrapping one.
+    """
+    server = http_server(httpd)
+    handler = server.RequestHandlerClass
+    if not issubclass(handler, CachingRequestHandlerMixin):
+        class CachingRequestHandler(CachingRequestHandlerMixin, handler):
+            pass
+        server.RequestHandlerClass = CachingRequestHandler
+    server.RequestHandlerClass.file_cache = file_cache
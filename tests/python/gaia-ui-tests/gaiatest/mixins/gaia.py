@@ -17,6 +17,28 @@ class GaiaArguments(object):
           'default': False,
           'help': 'restart target instance between tests',
           }],
+        [['--differential-cleanup'],
+         {'action': 'store_true',
+          'dest': 'differential_cleanup',
+          'default': False,
+          'help': 'record the device state at the end of each test and only reset the settings, '
+                  'network connections and contacts that have changed before the next test',
+          }],
+        [['--trace-commands'],
+         {'action': 'store_true',
+          'dest': 'trace_commands',
+          'default': False,
+          'help': 'record the Marionette commands sent by each test and log a summary of their '
+                  'counts, latencies and callers. Tests with a max_roundtrips manifest key are '
+                  'always traced and fail when they send more commands',
+          }],
+        [['--phase-report'],
+         {'dest': 'phase_report',
+          'help': 'file to write the time spent in each phase of the tests to at the end of the run, '
+                  'such as the steps of setUp, the test itself and tearDown. Written as CSV if the '
+                  'file name ends with .csv and as JSON otherwise. The phases of every test are also '
+                  'logged as a test_status message',
+          }],
         [['--locale'],
          {'default': "undefined",
           'help': 'locale for the device, This value overrides the value from testvars.json file',
@@ -36,8 +58,32 @@ class GaiaArguments(object):
           'help': 'directory path to saved video captures, relative to the current location, '
                   'Default folder is %(default)s',
           }],
+        [['--devices'],
+         {'dest': 'devices',
+          'help': 'comma separated list of device serials to run the tests on in parallel, '
+                  'tests are only assigned to devices with the capabilities listed for them in '
+                  'the "devices" key of the test variables',
+          }],
+        [['--shards'],
+         {'type': int,
+          'dest': 'shards',
+          'help': 'number of instances to run the tests on in parallel, each launched by its own worker',
+          }],
+        [['--test-durations'],
+         {'dest': 'test_durations',
+          'default': 'test_durations.json',
+          'help': 'file storing the durations of previous runs, used to balance the tests across '
+                  '--devices or --shards, relative to the current location. Default file is %(default)s',
+          }],
     ]
 
+    # verify_usage
+    def verify_usage_handler(self, args):
+        if args.devices and args.shards:
+            raise ValueError('--devices and --shards can not be used together')
+        if args.shards is not None and args.shards < 1:
+            raise ValueError('shards must be at least 1')
+
 
 class GaiaTestRunnerMixin(object):
     
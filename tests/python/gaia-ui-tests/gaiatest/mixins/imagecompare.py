@@ -15,7 +15,22 @@ class GaiaImageCompareArguments(object):
          {'type': int,
           'default': 15,
           'metavar': int,
-          'help': 'fuzz value supplied to ImageMagick call, in percentage. Default value is %(default)s percent.',
+          'help': 'colour difference tolerated between matching pixels, in percentage. '
+                  'Default value is %(default)s percent.',
+          }],
+        [['--hash-distance'],
+         {'type': int,
+          'metavar': int,
+          'help': 'treat screenshots as matching their reference without comparing pixels when their '
+                  'perceptual hashes differ by at most this many bits (out of 64). Disabled by default, '
+                  'only identical screenshots skip the comparison.',
+          }],
+        [['--screenshot-workers'],
+         {'type': int,
+          'default': 2,
+          'metavar': int,
+          'help': 'number of threads cropping, saving and comparing screenshots while the test continues, '
+                  '0 processes them immediately. Default value is %(default)s.',
           }],
         [['--reference-path'],
          {'default': 'reference_images',
@@ -31,3 +46,7 @@ class GaiaImageCompareArguments(object):
     def verify_usage_handler(self, args):
         if not 0 <= args.fuzz_factor <= 100:
             raise ValueError('fuzz_factor must be between 0 and 100')
+        if args.screenshot_workers < 0:
+            raise ValueError('screenshot_workers must not be negative')
+        if args.hash_distance is not None and not 0 <= args.hash_distance <= 64:
+            raise ValueError('hash_distance must be between 0 and 64')
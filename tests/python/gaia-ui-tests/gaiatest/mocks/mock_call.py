@@ -4,7 +4,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import time, datetime
+import datetime
+import random
+import time
+
+from gaiatest.mocks.mock_sms import generate_numbers
 
 
 class MockCall(dict):
@@ -29,3 +33,32 @@ class MockCall(dict):
     # allow getting items as if they were attributes
     def __getattr__(self, attr):
         return self[attr]
+
+
+def generate_calls(numbers=10, calls=100, seed=0, end=None, days=30, incoming=0.5, missed=0.2):
+    """
+    Yields call log entries for a number of participants, oldest first.
+
+    The same seed always produces the same participants, types, statuses and
+    durations, and the same dates relative to end. The call log groups calls
+    by day, number and type and only keeps the 200 most recent groups.
+
+    :param numbers: number of distinct participants.
+    :param calls: total number of calls.
+    :param end: time in seconds since the epoch of the newest call, defaults to now.
+    :param days: number of days before end the calls are spread over.
+    :param incoming: proportion of incoming calls, the others are outgoing.
+    :param missed: proportion of calls which were not connected.
+    """
+    rng = random.Random(seed)
+    end = end if end is not None else time.time()
+    participants = generate_numbers(numbers, rng)
+    offsets = sorted((rng.uniform(0, days * 86400) for i in range(calls)), reverse=True)
+    for i, offset in enumerate(offsets):
+        number = participants[i] if i < len(participants) else rng.choice(participants)
+        connected = rng.random() >= missed
+        yield MockCall(phone_number=number,
+                       call_type='incoming' if rng.random() < incoming else 'dialing',
+                       date=datetime.datetime.fromtimestamp(end - offset),
+                       duration=rng.randint(1, 600) * 1000 if connected else 0,
+                       status='connected' if connected else None)
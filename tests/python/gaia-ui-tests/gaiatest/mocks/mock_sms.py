@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import random
+import time
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing',
+         'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore',
+         'et', 'dolore', 'magna', 'aliqua', 'enim', 'ad', 'minim', 'veniam')
+
+
+class MockSms(dict):
+    '''
+    Mocks an SMS message as stored in the mobile message database.
+
+    Received messages have a sender, sent messages have a receiver. The
+    timestamp is in milliseconds since the epoch.
+    '''
+
+    def __init__(self, number='5551234567', body='Gaia automated test', timestamp=None,
+                 delivery='received', iccId=None, **kwargs):
+        super(MockSms, self).__init__(self, **kwargs)
+
+        timestamp = timestamp if timestamp is not None else int(time.time() * 1000)
+        self['type'] = 'sms'
+        self['body'] = body
+        self['timestamp'] = timestamp
+        self['delivery'] = delivery
+        self['iccId'] = iccId
+        if delivery == 'received':
+            self['sender'] = number
+            self['sentTimestamp'] = timestamp
+            self['messageClass'] = 'normal'
+        else:
+            self['receiver'] = number
+            self['deliveryStatusRequested'] = False
+
+        # update with any keyword arguments passed
+        self.update(**kwargs)
+
+    # allow getting items as if they were attributes
+    def __getattr__(self, attr):
+        return self[attr]
+
+    @property
+    def number(self):
+        return self['sender'] if self['delivery'] == 'received' else self['receiver']
+
+
+def generate_numbers(count, rng):
+    '''Returns count distinct phone numbers picked by the random generator rng.'''
+    numbers = []
+    while len(numbers) < count:
+        number = '555%07d' % rng.randint(0, 9999999)
+        if number not in numbers:
+            numbers.append(number)
+    return numbers
+
+
+def generate_sms(threads=10, messages=100, seed=0, end=None, days=30,
+                 min_length=10, max_length=160, received=0.5):
+    '''
+    Yields messages spread over a number of threads, oldest first.
+
+    The same seed always produces the same participants, message sizes and
+    bodies, and the same dates relative to end.
+
+    :param threads: number of distinct participants, every one of them gets at
+        least one message if there are enough messages.
+    :param messages: total number of messages.
+    :param end: time in seconds since the epoch of the newest message, defaults
+        to now.
+    :param days: number of days before end the messages are spread over.
+    :param min_length: minimum number of characters of a message body.
+    :param max_length: maximum number of characters of a message body.
+    :param received: proportion of received messages, the others are sent.
+    '''
+    rng = random.Random(seed)
+    end = end if end is not None else time.time()
+    numbers = generate_numbers(threads, rng)
+    offsets = sorted((rng.uniform(0, days * 86400) for i in range(messages)), reverse=True)
+    for i, offset in enumerate(offsets):
+        number = numbers[i] if i < len(numbers) else rng.choice(numbers)
+        length = rng.randint(min_length, max_length)
+        words = []
+        while len(' '.join(words)) < length:
+            words.append(rng.choice(WORDS))
+        yield MockSms(number=number,
+                      body=' '.join(words)[:length],
+                      timestamp=int((end - offset) * 1000),
+                      delivery='received' if rng.random() < received else 'sent')
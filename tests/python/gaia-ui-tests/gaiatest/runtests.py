@@ -4,20 +4,25 @@
 
 import json
 import os
+import sys
 
 from marionette import (BaseMarionetteArguments,
                         MarionetteTextTestRunner,
                         MarionetteTestResult,
                         BaseMarionetteTestRunner)
 from marionette.runtests import cli
+from manifestparser import TestManifest
 import mozlog
 
 from gaiatest import __name__
+from gaiatest.httpd import FileCache, install_file_cache, is_not_modified, validator_headers
 
 from gaiatest import (GaiaTestCase,
                       GaiaArguments,
                       GaiaTestRunnerMixin,
                       GaiaImageCompareArguments)
+from sharding import device_serials, GaiaShardRunner
+from tracing import PhaseTimer
 from version import __version__
 
 
@@ -30,7 +35,11 @@ class GaiaTestArguments(BaseMarionetteArguments):
 
 
 class GaiaTestResult(MarionetteTestResult):
-    pass
+
+    def startTest(self, test):
+        # the id of a test only names its file, so also log the path of the file
+        self.testsRun += 1
+        self.logger.test_start(test.id(), path=getattr(test, 'filepath', None))
 
 
 class GaiaTextTestRunner(MarionetteTextTestRunner):
@@ -73,22 +82,67 @@ class GaiaTestRunner(BaseMarionetteTestRunner, GaiaTestRunnerMixin):
         BaseMarionetteTestRunner.__init__(self, result_callbacks=[gather_debug], **kwargs)
         GaiaTestRunnerMixin.__init__(self, **kwargs)
         self.test_handlers = [GaiaTestCase]
+        # round trip budgets of the tests, from the max_roundtrips manifest key
+        self.roundtrip_budgets = {}
+        self.phase_report = kwargs.get('phase_report')
+        # files served by the httpd, kept across tests
+        self.file_cache = FileCache()
+
+    def add_test(self, test, *args, **kwargs):
+        if test.endswith('.ini'):
+            manifest = TestManifest(manifests=[os.path.abspath(test)], strict=False)
+            for t in manifest.tests:
+                if t.get('max_roundtrips'):
+                    self.roundtrip_budgets[t['path']] = int(t['max_roundtrips'])
+        return BaseMarionetteTestRunner.add_test(self, test, *args, **kwargs)
+
+    def run_tests(self, *args, **kwargs):
+        try:
+            return BaseMarionetteTestRunner.run_tests(self, *args, **kwargs)
+        finally:
+            if self.phase_report and PhaseTimer.totals:
+                PhaseTimer.write_report(self.phase_report)
+                self.logger.info('Phase timings written to %s' % self.phase_report)
+
+    def run_test(self, filepath, *args, **kwargs):
+        self.test_kwargs['max_roundtrips'] = self.roundtrip_budgets.get(os.path.abspath(filepath))
+        return BaseMarionetteTestRunner.run_test(self, filepath, *args, **kwargs)
 
     def start_httpd(self, need_external_ip):
         super(GaiaTestRunner, self).start_httpd(need_external_ip)
         if self.httpd is not None:
+            install_file_cache(self.httpd, self.file_cache)
             self.httpd.urlhandlers.append({
                 'method': 'GET',
                 'path': '.*\.webapp',
                 'function': self.webapp_handler})
 
     def webapp_handler(self, request):
-        with open(os.path.join(self.server_root, request.path[1:]), 'r') as f:
-            data = f.read()
-        return (200, {
+        cached = self.file_cache.get(os.path.join(self.server_root, request.path[1:]))
+        headers = validator_headers(cached)
+        if is_not_modified(request.headers, cached):
+            return (304, headers, '')
+        data = cached.read()
+        headers.update({
             'Content-type': 'application/x-web-app-manifest+json',
-            'Content-Length': len(data)}, data)
+            'Content-Length': len(data)})
+        return (200, headers, data)
 
 
 def main():
+    argv = sys.argv[1:]
+    parser = GaiaTestArguments(usage='%(prog)s [options] test_file_or_dir <test_file_or_dir> ...')
+    mozlog.commandline.add_logging_group(parser)
+    args, unknown = parser.parse_known_args(argv)
+    if args.devices is not None or args.shards is not None:
+        # run the tests in parallel workers, each of them running this runner
+        if args.devices is not None and args.shards is not None:
+            parser.error('--devices and --shards can not be used together')
+        if args.devices is not None and not device_serials(args.devices):
+            parser.error('--devices must list at least one device serial')
+        if args.shards is not None and args.shards < 1:
+            parser.error('--shards must be at least 1')
+        parser.verify_usage(args)
+        logger = mozlog.commandline.setup_logging('gaiatest', args, {'mach': sys.stdout})
+        sys.exit(GaiaShardRunner(args, argv, logger).run())
     cli(runner_class=GaiaTestRunner, parser_class=GaiaTestArguments)
@@ -0,0 +1,374 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from manifestparser import TestManifest
+import mozfile
+from mozlog.commandline import fmt_options
+
+from tracing import PhaseTimer
+
+# manifest keys describing hardware a test requires from the device running it
+CAPABILITIES = ('antenna', 'bluetooth', 'camera', 'carrier', 'dsds',
+                'flash', 'qemu', 'sdcard', 'wifi')
+
+# keys added by manifestparser which must not be written to a shard manifest
+MANIFEST_INTERNAL_KEYS = ('path', 'relpath', 'name', 'here', 'manifest',
+                          'manifest_relpath', 'dir_relpath', 'ancestor-manifest')
+
+# options handled by the sharding runner and never passed on to the workers
+SHARD_OPTIONS = ('--devices', '--shards', '--test-durations', '--phase-report')
+
+# options set by the sharding runner for each worker
+WORKER_OPTIONS = ('--address', '--device')
+
+
+class GaiaShard(object):
+    """A worker process running a subset of the tests against one target."""
+
+    def __init__(self, index, serial=None, address=None, capabilities=None):
+        self.index = index
+        self.serial = serial
+        self.address = address
+        # None means the target is able to run any test
+        self.capabilities = capabilities
+        self.tests = []
+        self.weight = 0
+        self.process = None
+
+    @property
+    def name(self):
+        return self.serial or 'shard%d' % self.index
+
+    def accepts(self, test):
+        if self.capabilities is None:
+            return True
+        return all(c in self.capabilities for c in required_capabilities(test))
+
+    def add(self, test, weight=1):
+        self.tests.append(test)
+        self.weight += weight
+
+
+def required_capabilities(test):
+    """Returns the hardware capabilities a manifest test requires."""
+    return [c for c in CAPABILITIES if str(test.get(c, 'false')).lower() == 'true']
+
+
+def device_serials(devices):
+    """Returns the serials listed in the value of --devices."""
+    return [s.strip() for s in devices.split(',') if s.strip()]
+
+
+def assign_tests(tests, shards, weight=None, logger=None):
+    """Distribute tests over shards, honouring the shards' capabilities.
+
+    Tests are placed on the eligible shard with the lowest total weight, the
+    most constrained tests first so they are not crowded out, then the
+    heaviest first (longest processing time first scheduling).
+
+    :param tests: list of manifest test dictionaries.
+    :param shards: list of :class:`GaiaShard` objects.
+    :param weight: callable returning the expected cost of a test, every test
+        costs 1 by default.
+    :raises ValueError: if there are no shards.
+    """
+    if not shards:
+        raise ValueError('No shards to assign the tests to')
+    weight = weight or (lambda test: 1)
+    candidates = [(test, [s for s in shards if s.accepts(test)]) for test in tests]
+    candidates.sort(key=lambda c: (len(c[1]), -weight(c[0])))
+    for test, eligible in candidates:
+        if not eligible:
+            if logger:
+                logger.warning('No shard has the capabilities (%s) required by %s' % (
+                    ', '.join(required_capabilities(test)), test['path']))
+            eligible = shards
+        min(eligible, key=lambda s: s.weight).add(test, weight(test))
+    return shards
+
+
+def test_key(test):
+    """Returns the path identifying a test file, relative to the manifest or directory it was loaded from."""
+    return test.get('relpath') or os.path.basename(test['path'])
+
+
+class GaiaTestDurations(object):
+    """Durations of test files in milliseconds, persisted as JSON between runs.
+
+    Test files are identified by :func:`test_key`. The structured logs of the
+    workers give the path of the file of every test they start.
+
+    :param path: file the durations are stored in.
+    :param tests: the manifest test dictionaries of the tests that are run.
+    """
+
+    def __init__(self, path=None, tests=()):
+        self.path = path
+        self.durations = {}
+        self.keys = dict((test['path'], test_key(test)) for test in tests)
+        self._started = {}
+        self._run = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.durations = json.load(f)
+
+    def __len__(self):
+        return len(self.durations)
+
+    def weight(self, test):
+        """Returns the expected duration of a test, or the mean of all known durations."""
+        key = test_key(test)
+        if key in self.durations:
+            return self.durations[key]
+        if self.durations:
+            return sum(self.durations.values()) / len(self.durations)
+        return 1
+
+    def add_entry(self, data):
+        """Record a structured log entry, tracking the duration of every test file."""
+        if data.get('action') == 'test_start':
+            self._started[data['test']] = (data['time'], data.get('path'))
+        elif data.get('action') == 'test_end' and data['test'] in self._started:
+            started, path = self._started.pop(data['test'])
+            # tests skipped by the manifest are logged without a path
+            key = self.keys.get(path)
+            if key is not None:
+                self._run[key] = self._run.get(key, 0) + data['time'] - started
+
+    def start(self):
+        self._run = {}
+
+    def save(self):
+        """Update the stored durations with those of the tests run since start."""
+        self.durations.update(self._run)
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.durations, f, sort_keys=True, indent=2)
+
+
+def load_tests(paths):
+    """Returns manifest test dictionaries for the given test files, directories and manifests."""
+    tests = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if path.endswith('.ini'):
+            tests.extend(TestManifest(manifests=[path], strict=False).tests)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                tests.extend({'path': os.path.join(root, f),
+                              'relpath': os.path.relpath(os.path.join(root, f), path)}
+                             for f in sorted(files) if f.startswith('test_') and f.endswith('.py'))
+        else:
+            tests.append({'path': path})
+    return tests
+
+
+def write_manifest(tests, path):
+    """Writes a manifest containing tests, keeping all of their keys."""
+    with open(path, 'w') as f:
+        for test in tests:
+            f.write('[%s]\n' % test['path'])
+            for key, value in sorted(test.items()):
+                if key not in MANIFEST_INTERNAL_KEYS:
+                    f.write('%s = %s\n' % (key, value))
+            f.write('\n')
+
+
+def is_worker_option(option):
+    """Whether an option is passed on to the workers, rather than handled or set by the sharding runner."""
+    return option not in SHARD_OPTIONS + WORKER_OPTIONS and not option.startswith('--log-')
+
+
+def takes_value(option):
+    """Whether an option which is not passed on to the workers is followed by a value."""
+    if option.startswith('--log-'):
+        # --log-<formatter> or --log-<formatter>-<setting>, see mozlog.commandline
+        setting = option[len('--log-'):].split('-', 1)[1:]
+        return not setting or fmt_options.get(setting[0], (None, None, None, 'store'))[3] != 'store_true'
+    return True
+
+
+def split_arguments(argv, tests):
+    """Split a command line into the arguments to pass on to the workers and the tests.
+
+    The options handled or set by the sharding runner are dropped along with
+    their values.
+
+    :param argv: the command line.
+    :param tests: the tests, as parsed from argv.
+    """
+    remaining = list(tests)
+    arguments = []
+    positionals = []
+    argv = list(argv)
+    while argv:
+        token = argv.pop(0)
+        if token == '--':
+            positionals.extend(argv)
+            break
+        option = token.split('=', 1)[0]
+        if option.startswith('-') and not is_worker_option(option):
+            if '=' not in token and takes_value(option) and argv:
+                argv.pop(0)
+        elif token in remaining:
+            remaining.remove(token)
+            positionals.append(token)
+        else:
+            arguments.append(token)
+    return arguments, positionals
+
+
+class GaiaShardRunner(object):
+    """Runs tests in parallel worker processes, one per device or instance.
+
+    The structured log of every worker is merged into the log of this process.
+    """
+
+    def __init__(self, args, argv, logger):
+        self.logger = logger
+        self.tests = load_tests(args.tests)
+        self.durations = GaiaTestDurations(args.test_durations, self.tests)
+        self.phase_report = args.phase_report
+        self.tmpdir = tempfile.mkdtemp(prefix='gaiatest-shards-')
+
+        testvars = {}
+        paths = args.testvars or []
+        for path in paths if isinstance(paths, list) else [paths]:
+            with open(path) as f:
+                testvars.update(json.load(f))
+        capabilities = testvars.get('devices', {})
+
+        host, port = (args.address or 'localhost:2828').split(':')
+        if args.devices:
+            serials = device_serials(args.devices)
+            self.shards = [GaiaShard(i, serial=s, address='%s:%d' % (host, int(port) + i),
+                                     capabilities=capabilities.get(s))
+                           for i, s in enumerate(serials)]
+        else:
+            # instances are launched by the workers, so give each its own port
+            emulator = getattr(args, 'emulator', None)
+            self.shards = [GaiaShard(i, address=None if emulator else '%s:%d' % (host, int(port) + i))
+                           for i in range(args.shards)]
+
+        self.worker_options = split_arguments(argv, args.tests)[0]
+
+    def forward_port(self, shard):
+        from mozdevice import DeviceManagerADB
+        dm = DeviceManagerADB(deviceSerial=shard.serial)
+        dm.forward('tcp:%s' % shard.address.split(':')[1], 'tcp:2828')
+
+    def worker_command(self, shard, manifest, raw_log):
+        command = [sys.executable, '-c', 'from gaiatest.runtests import main; main()']
+        command.extend(self.worker_options)
+        if shard.serial:
+            command.extend(['--device', shard.serial])
+        if shard.address:
+            command.extend(['--address', shard.address])
+        if self.phase_report:
+            command.extend(['--phase-report', shard.phase_report])
+        command.extend(['--log-raw', raw_log, manifest])
+        return command
+
+    def start(self, shard):
+        manifest = os.path.join(self.tmpdir, '%s.ini' % shard.name)
+        write_manifest(shard.tests, manifest)
+        shard.raw_log = os.path.join(self.tmpdir, '%s.log' % shard.name)
+        shard.output = os.path.join(self.tmpdir, '%s.out' % shard.name)
+        shard.phase_report = os.path.join(self.tmpdir, '%s.phases.json' % shard.name)
+        open(shard.raw_log, 'w').close()
+        shard.offset = 0
+        if shard.serial:
+            self.forward_port(shard)
+        self.logger.info('Starting %s with %d tests' % (shard.name, len(shard.tests)))
+        shard.started = time.time()
+        shard.finished = None
+        with open(shard.output, 'w') as output:
+            shard.process = subprocess.Popen(
+                self.worker_command(shard, manifest, shard.raw_log),
+                stdout=output, stderr=subprocess.STDOUT)
+
+    def merge_log(self, shard):
+        """Forward complete entries of a worker's structured log to our logger."""
+        with open(shard.raw_log) as f:
+            f.seek(shard.offset)
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    break
+                shard.offset += len(line)
+                data = json.loads(line)
+                if data.get('action') in ('suite_start', 'suite_end'):
+                    continue
+                data['shard'] = shard.name
+                self.durations.add_entry(data)
+                self.logger.log_raw(data)
+
+    def report_makespan(self, predicted=True):
+        """Log the predicted and actual duration of every shard and of the whole run."""
+        for shard in self.shards:
+            actual = shard.finished - shard.started
+            if predicted:
+                self.logger.info('%s: predicted %.1fs, actual %.1fs' % (
+                    shard.name, shard.weight / 1000.0, actual))
+            else:
+                self.logger.info('%s: actual %.1fs' % (shard.name, actual))
+        actual = max(s.finished for s in self.shards) - min(s.started for s in self.shards)
+        if predicted:
+            self.logger.info('Makespan: predicted %.1fs, actual %.1fs' % (
+                max(s.weight for s in self.shards) / 1000.0, actual))
+        else:
+            self.logger.info('Makespan: actual %.1fs' % actual)
+
+    def write_phase_report(self):
+        """Combine the phase timings reported by every shard."""
+        for shard in self.shards:
+            if os.path.exists(shard.phase_report):
+                PhaseTimer.read_report(shard.phase_report)
+        if PhaseTimer.totals:
+            PhaseTimer.write_report(self.phase_report)
+            self.logger.info('Phase timings written to %s' % self.phase_report)
+
+    def run(self):
+        try:
+            balanced = len(self.durations) > 0
+            if balanced:
+                # longest processing time first, using the durations of previous runs
+                self.logger.info('Balancing shards using %d known test durations' % len(self.durations))
+                assign_tests(self.tests, self.shards, weight=self.durations.weight, logger=self.logger)
+            else:
+                assign_tests(self.tests, self.shards, logger=self.logger)
+            self.shards = [s for s in self.shards if s.tests]
+            self.logger.suite_start([t['path'] for s in self.shards for t in s.tests])
+            self.durations.start()
+            for shard in self.shards:
+                self.start(shard)
+            while any(s.finished is None for s in self.shards):
+                for shard in self.shards:
+                    self.merge_log(shard)
+                    if shard.finished is None and shard.process.poll() is not None:
+                        shard.finished = time.time()
+                time.sleep(0.5)
+            failed = []
+            for shard in self.shards:
+                self.merge_log(shard)
+                if shard.process.returncode != 0:
+                    failed.append(shard)
+                    self.logger.error('%s exited with code %d, see %s' % (
+                        shard.name, shard.process.returncode, shard.output))
+            self.logger.suite_end()
+            self.durations.save()
+            if self.phase_report:
+                self.write_phase_report()
+            if self.shards:
+                self.report_makespan(predicted=balanced)
+            return len(failed)
+        finally:
+            if not any(s.process and s.process.returncode for s in self.shards):
+                mozfile.remove(self.tmpdir)
@@ -13,6 +13,15 @@ class TestSettings(GaiaTestCase):
         self.data_layer.set_setting(setting_name, 'my.value')
         self.assertEquals(self.data_layer.get_setting(setting_name), 'my.value')
 
+    def test_set_multiple_settings(self):
+        settings = {'my.first.setting': 'first.value',
+                    'my.second.setting': 2,
+                    'my.third.setting': True}
+
+        self.data_layer.set_settings(settings)
+        for name, value in settings.items():
+            self.assertEquals(self.data_layer.get_setting(name), value)
+
     def test_set_volume(self):
         channels = ['alarm', 'content', 'notification']
 
@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase, AppRegistry
+from gaiatest.apps.clock.app import Clock
+
+
+class TestAppRegistry(GaiaTestCase):
+
+    def test_installed_apps_cached(self):
+        registry = AppRegistry.get(self.marionette)
+        apps = self.apps.installed_apps
+        misses = registry.misses
+        self.assertEqual([a.name for a in self.apps.installed_apps], [a.name for a in apps])
+        self.assertEqual(registry.misses, misses)
+
+    def test_running_apps_follow_launch_and_kill(self):
+        self.assertNotIn(Clock.name, [a.name for a in self.apps.running_apps()])
+        self.apps.launch(Clock.name)
+        self.assertIn(Clock.name, [a.name for a in self.apps.running_apps()])
+        self.apps.kill_all()
+        self.assertNotIn(Clock.name, [a.name for a in self.apps.running_apps()])
+
+    def test_displayed_app_cached(self):
+        registry = AppRegistry.get(self.marionette)
+        self.apps.launch(Clock.name)
+        self.assertEqual(self.apps.displayed_app.name, Clock.name)
+        misses = registry.misses
+        self.assertEqual(self.apps.displayed_app.name, Clock.name)
+        self.assertEqual(registry.misses, misses)
+
+        # apps opened without going through GaiaApps are noticed too
+        self.marionette.switch_to_frame()
+        self.marionette.execute_script("window.wrappedJSObject.dispatchEvent(new Event('home'));")
+        self.wait_for_condition(lambda m: self.apps.displayed_app.name != Clock.name)
+        self.assertGreater(registry.misses, misses)
+
+    def test_switch_to_displayed_app_cached(self):
+        registry = AppRegistry.get(self.marionette)
+        app = self.apps.launch(Clock.name)
+        self.apps.switch_to_displayed_app()
+        misses = registry.misses
+        self.marionette.switch_to_frame()
+        self.apps.switch_to_displayed_app()
+        self.apps.switch_to_displayed_app()
+        self.assertFalse(registry.stale)
+        self.assertEqual(registry.misses, misses)
+        self.assertEqual(self.marionette.execute_script('return window.location.origin;'), app.origin)
+
+        # scripts may change the displayed app, so its count is read again
+        self.assertTrue(registry.stale)
+        self.apps.switch_to_displayed_app()
+        self.assertFalse(registry.stale)
+        self.assertEqual(registry.misses, misses)
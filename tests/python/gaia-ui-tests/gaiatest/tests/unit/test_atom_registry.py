@@ -0,0 +1,27 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase, GaiaApps, GaiaData, AtomRegistry
+
+
+class TestAtomRegistry(GaiaTestCase):
+
+    def test_atoms_imported_once(self):
+        atoms = AtomRegistry.get(self.marionette)
+        self.assertIs(AtomRegistry.get(self.marionette), atoms)
+        imports, avoided = atoms.imports, atoms.avoided
+        for i in range(3):
+            GaiaApps(self.marionette)
+            GaiaData(self.marionette)
+        self.assertEqual(atoms.imports, imports)
+        self.assertEqual(atoms.avoided, avoided + 9)
+        self.assertTrue(GaiaApps(self.marionette).displayed_app.name)
+
+    def test_atoms_imported_again_after_clear(self):
+        atoms = AtomRegistry.get(self.marionette)
+        imports = atoms.imports
+        self.marionette.clear_imported_scripts()
+        GaiaApps(self.marionette)
+        self.assertEqual(atoms.imports, imports + 1)
+        self.assertTrue(GaiaApps(self.marionette).displayed_app.name)
@@ -0,0 +1,20 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+
+
+class TestCommandTracing(GaiaTestCase):
+
+    def test_command_tracing(self):
+        if not self.command_tracer:
+            self.start_command_tracing()
+        roundtrips = self.command_tracer.roundtrips
+        self.data_layer.get_setting('language.current')
+        self.assertGreater(self.command_tracer.roundtrips, roundtrips)
+
+        summary = self.stop_command_tracing()
+        self.assertEqual(summary['roundtrips'], sum(summary['commands'].values()))
+        self.assertLessEqual(summary['median_ms'], summary['p95_ms'])
+        self.assertIn('TestCommandTracing.test_command_tracing', [c['caller'] for c in summary['top_callers']])
@@ -25,3 +25,14 @@ class TestContacts(GaiaTestCase):
         self.assertEqual(len(self.data_layer.all_contacts), 1)
         self.data_layer.remove_all_contacts()
         self.assertEqual(self.data_layer.all_contacts, [])
+
+    def test_insert_multiple_contacts(self):
+        self.data_layer.insert_contacts([MockContact() for i in range(5)], chunk_size=2)
+        self.assertEqual(self.data_layer.contacts_count, 5)
+        self.data_layer.remove_all_contacts()
+        self.assertEqual(self.data_layer.contacts_count, 0)
+
+    def test_insert_contacts_from_generator(self):
+        contacts = (MockContact() for i in range(3))
+        self.assertEqual(list(self.data_layer.insert_contacts_iter(contacts, chunk_size=2)), [2, 3])
+        self.assertEqual(len(self.data_layer.all_contacts), 3)
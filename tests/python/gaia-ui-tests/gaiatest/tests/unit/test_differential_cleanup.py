@@ -0,0 +1,46 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+from gaiatest.mocks.mock_contact import MockContact
+
+
+class TestDifferentialCleanup(GaiaTestCase):
+
+    def test_unchanged_state(self):
+        self.record_state()
+        state = GaiaTestCase._device_state
+        self.assertEqual(state['contacts'], 0)
+        self.assertEqual(state['digest'], self.data_layer.state_digest(state))
+        self.assertEqual(self.data_layer.changed_settings(state, self._default_settings()), {})
+
+    def test_skip_unchanged_state(self):
+        GaiaTestCase._clean_state_digest = self._state_snapshot()['digest']
+        self.record_state()
+        state = GaiaTestCase._device_state
+        self.assertEqual(state['digest'], GaiaTestCase._clean_state_digest)
+
+        self.data_layer.set_volume(5)
+        self.cleanup_gaia(previous_state=state)
+        # the change was made after the state was recorded, so it is kept
+        self.assertEqual(self.data_layer.get_setting('audio.volume.content'), 5)
+
+    def test_cleanup_changed_state(self):
+        self.data_layer.set_volume(5)
+        self.data_layer.insert_contact(MockContact())
+
+        self.record_state()
+        state = GaiaTestCase._device_state
+        self.assertEqual(state['contacts'], 1)
+        self.assertIn('audio.volume.content',
+                      self.data_layer.changed_settings(state, self._default_settings()))
+
+        self.cleanup_gaia(previous_state=state)
+        self.assertEqual(self.data_layer.get_setting('audio.volume.content'), 0)
+        self.assertEqual(self.data_layer.all_contacts, [])
+
+    def tearDown(self):
+        GaiaTestCase._device_state = None
+        GaiaTestCase._clean_state_digest = None
+        GaiaTestCase.tearDown(self)
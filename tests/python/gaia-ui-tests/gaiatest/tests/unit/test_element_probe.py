@@ -0,0 +1,83 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from marionette_driver import By
+
+from gaiatest import GaiaTestCase, ElementProbe
+
+
+class TestElementProbe(GaiaTestCase):
+
+    def setUp(self):
+        GaiaTestCase.setUp(self)
+        self.marionette.switch_to_frame()
+        self.marionette.execute_script("""
+          var shown = document.createElement('div');
+          shown.id = 'gaiatest-shown';
+          shown.textContent = 'gaiatest';
+          var hidden = shown.cloneNode(true);
+          hidden.id = 'gaiatest-hidden';
+          hidden.style.display = 'none';
+          document.body.appendChild(shown);
+          document.body.appendChild(hidden);""")
+
+    def tearDown(self):
+        self.marionette.execute_script("""
+          var elements = document.querySelectorAll('[id^="gaiatest-"]');
+          Array.prototype.forEach.call(elements, function(element) {
+            element.remove();
+          });""")
+        GaiaTestCase.tearDown(self)
+
+    def test_probe(self):
+        shown, hidden, missing = ElementProbe(self.marionette).probe(
+            (By.ID, 'gaiatest-shown'), (By.CSS_SELECTOR, '#gaiatest-hidden'), (By.ID, 'gaiatest-missing'))
+
+        self.assertTrue(shown['present'])
+        self.assertTrue(shown['displayed'])
+        self.assertEqual(shown['displayed'], shown['element'].is_displayed())
+        self.assertGreater(shown['rect']['height'], 0)
+
+        self.assertTrue(hidden['present'])
+        self.assertFalse(hidden['displayed'])
+        self.assertEqual(hidden['displayed'], hidden['element'].is_displayed())
+
+        self.assertEqual(missing, {'present': False, 'displayed': False, 'rect': None, 'element': None})
+
+    def test_chrome_context(self):
+        with self.marionette.using_context(self.marionette.CONTEXT_CHROME):
+            root, missing = ElementProbe(self.marionette).probe(
+                (By.CSS_SELECTOR, ':root'), (By.ID, 'gaiatest-missing'))
+        self.assertTrue(root['present'])
+        self.assertFalse(missing['present'])
+
+    def test_snapshot(self):
+        snapshots = ElementProbe(self.marionette).snapshot(
+            By.CSS_SELECTOR, '[id^="gaiatest-"]', attributes=['id', 'data-missing'])
+        self.assertEqual([s.get_attribute('id') for s in snapshots], ['gaiatest-shown', 'gaiatest-hidden'])
+        self.assertEqual([s.displayed for s in snapshots], [True, False])
+        self.assertEqual(snapshots[0].text, 'gaiatest')
+        self.assertIsNone(snapshots[0].get_attribute('data-missing'))
+        self.assertEqual(snapshots[0].element.get_attribute('id'), 'gaiatest-shown')
+
+    def test_displayed(self):
+        self.marionette.execute_script("""
+          document.body.insertAdjacentHTML('beforeend',
+            '<div id="gaiatest-clip" style="overflow: hidden; width: 100px; height: 100px;">' +
+            '  <div id="gaiatest-escaped" style="position: absolute; top: 0; left: 150px;">gaiatest</div>' +
+            '  <div id="gaiatest-clipped" style="position: relative; left: 150px;">gaiatest</div>' +
+            '  <div style="position: relative; overflow: hidden; width: 100px; height: 100px;">' +
+            '    <div id="gaiatest-contained" style="position: absolute; top: 0; left: 150px;">gaiatest</div>' +
+            '  </div>' +
+            '</div>' +
+            '<div style="opacity: 0;"><div id="gaiatest-transparent">gaiatest</div></div>' +
+            '<div id="gaiatest-invisible" style="visibility: hidden;">gaiatest</div>');""")
+        cases = [('gaiatest-escaped', True), ('gaiatest-clipped', False), ('gaiatest-contained', False),
+                 ('gaiatest-transparent', False), ('gaiatest-invisible', False)]
+        probe = ElementProbe(self.marionette)
+        results = probe.probe(*[(By.ID, case[0]) for case in cases])
+        for (name, displayed), result in zip(cases, results):
+            self.assertEqual(displayed, result['displayed'], name)
+            self.assertEqual(displayed, probe.is_displayed(By.ID, name), name)
+            self.assertEqual(displayed, probe.snapshot(By.ID, name)[0].displayed, name)
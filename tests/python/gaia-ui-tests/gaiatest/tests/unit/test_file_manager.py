@@ -8,6 +8,7 @@ import posixpath
 import mozfile
 
 from gaiatest import GaiaTestCase
+from gaiatest.file_manager import file_digest
 
 
 class TestFileManager(GaiaTestCase):
@@ -60,12 +61,55 @@ class TestFileManager(GaiaTestCase):
         self.assertTrue(self.device.file_manager.file_exists(
             '/'.join([self.device.storage_path, filename])))
 
+    def test_push_cached_file(self):
+        cache_path = getattr(self.device.file_manager, 'cache_path', None)
+        if not cache_path:
+            self.skipTest('File manager does not cache pushed files')
+        filename = 'IMG_0001.jpg'
+        path = '/'.join([self.device.storage_path, filename])
+        self.device.file_manager.clear_cache()
+        for i in range(2):
+            self.device.file_manager.push_file(self.resource(filename))
+            self.assertTrue(self.device.file_manager.file_exists(path))
+            with open(self.resource(filename), 'rb') as f:
+                self.assertEqual(self.device.file_manager.pull_file(path), f.read())
+            self.device.file_manager.remove(path)
+        self.assertTrue(self.device.file_manager.file_exists(
+            posixpath.join(cache_path, file_digest(self.resource(filename)))))
+
+    def test_trim_cache(self):
+        file_manager = self.device.file_manager
+        if not getattr(file_manager, 'cache_path', None):
+            self.skipTest('File manager does not cache pushed files')
+        file_manager.clear_cache()
+        file_manager.cache_size = 0
+        try:
+            for filename in ['IMG_0001.jpg', 'MUS_0001.mp3']:
+                file_manager.push_file(self.resource(filename))
+        finally:
+            del file_manager.cache_size
+        # only the file just pushed is kept beyond the size of the cache
+        self.assertEqual(file_manager.list_items(file_manager.cache_path),
+                         [file_digest(self.resource('MUS_0001.mp3'))])
+
     def test_remove_dir(self):
         path = '/'.join([self.device.storage_path, 'foo'])
         self.device.file_manager.make_dirs('/'.join([path, 'bar']))
         self.device.file_manager.remove(path)
         self.assertFalse(self.device.file_manager.dir_exists(path))
 
+    def test_remove_many(self):
+        filename = 'IMG_0001.jpg'
+        path = '/'.join([self.device.storage_path, 'foo'])
+        self.device.file_manager.push_file(self.resource(filename), path)
+        self.device.file_manager.make_dirs('/'.join([path, 'bar', 'baz']))
+        # the file and the bar directory, with baz inside it
+        self.assertEqual(self.device.file_manager.remove_many([path]), 2)
+        self.assertTrue(self.device.file_manager.dir_exists(path))
+        self.assertEqual(self.device.file_manager.list_items(path), [])
+        self.device.file_manager.remove_many([path], glob_children=False)
+        self.assertFalse(self.device.file_manager.dir_exists(path))
+
     def test_remove_file(self):
         filename = 'IMG_0001.jpg'
         self.device.file_manager.push_file(self.resource(filename))
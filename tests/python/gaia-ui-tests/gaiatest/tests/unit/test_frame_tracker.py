@@ -0,0 +1,27 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase, FrameTracker
+
+
+class TestFrameTracker(GaiaTestCase):
+
+    def test_redundant_switches_skipped(self):
+        tracker = FrameTracker.get(self.marionette)
+        self.marionette.switch_to_frame()
+        skipped = tracker.skipped_switches
+        self.marionette.switch_to_frame()
+        self.marionette.switch_to_default_content()
+        self.assertEqual(tracker.skipped_switches, skipped + 2)
+        self.assertIn('system.gaiamobile.org', self.marionette.execute_script('return window.location.href;'))
+
+    def test_untracked_commands_forget_frame(self):
+        tracker = FrameTracker.get(self.marionette)
+        self.apps.launch('Settings')
+        self.marionette.switch_to_parent_frame()
+        self.assertIsNone(tracker.frame)
+        skipped = tracker.skipped_switches
+        self.marionette.switch_to_frame()
+        self.assertEqual(tracker.skipped_switches, skipped)
+        self.assertEqual(tracker.frame, FrameTracker.TOP)
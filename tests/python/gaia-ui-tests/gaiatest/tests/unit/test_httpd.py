@@ -0,0 +1,52 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import urllib2
+
+from gaiatest import GaiaTestCase
+
+
+class TestHttpd(GaiaTestCase):
+
+    def request(self, path, **headers):
+        try:
+            response = urllib2.urlopen(urllib2.Request(
+                self.marionette.absolute_url(path), headers=headers))
+            return response.code, response.info(), response.read()
+        except urllib2.HTTPError as e:
+            return e.code, e.info(), e.read()
+
+    def test_conditional_request(self):
+        code, headers, data = self.request('mozilla.html')
+        self.assertEqual(200, code)
+        self.assertTrue(data)
+
+        code, _, data = self.request('mozilla.html', **{'If-None-Match': headers['ETag']})
+        self.assertEqual(304, code)
+        self.assertEqual('', data)
+
+        code, _, _ = self.request('mozilla.html', **{'If-Modified-Since': headers['Last-Modified']})
+        self.assertEqual(304, code)
+
+    def test_range_request(self):
+        code, headers, data = self.request('VID_counter.ogv')
+        self.assertEqual(200, code)
+        self.assertEqual('bytes', headers['Accept-Ranges'])
+
+        code, headers, part = self.request('VID_counter.ogv', Range='bytes=100-199')
+        self.assertEqual(206, code)
+        self.assertEqual('bytes 100-199/%d' % len(data), headers['Content-Range'])
+        self.assertEqual(data[100:200], part)
+
+        code, _, _ = self.request('VID_counter.ogv', Range='bytes=%d-' % len(data))
+        self.assertEqual(416, code)
+
+    def test_webapp_manifest(self):
+        path = 'webapps/mozqa.com/manifest.webapp'
+        code, headers, data = self.request(path)
+        self.assertEqual(200, code)
+        self.assertEqual('application/x-web-app-manifest+json', headers['Content-type'])
+
+        code, _, _ = self.request(path, **{'If-None-Match': headers['ETag']})
+        self.assertEqual(304, code)
@@ -0,0 +1,45 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+from PIL import Image
+
+from gaiatest.gaia_graphics_test import image_diff
+
+
+# needs no device, so it is run with unittest rather than listed in the manifest
+class TestImageDiff(unittest.TestCase):
+
+    def images(self, pixel, reference_pixel):
+        target = Image.new('RGBA', (2, 1), (100, 100, 100, 255))
+        reference = target.copy()
+        target.putpixel((1, 0), pixel)
+        reference.putpixel((1, 0), reference_pixel)
+        return target, reference
+
+    def test_fuzz_boundary(self):
+        # every colour channel differs by 51, 20% of the full range
+        target, reference = self.images((151, 151, 151, 255), (100, 100, 100, 255))
+        self.assertEqual(0, image_diff(target, reference, 20)[0])
+        count, mismatches = image_diff(target, reference, 19.9)
+        self.assertEqual(1, count)
+        self.assertEqual([[False, True]], mismatches.tolist())
+
+    def test_single_channel(self):
+        # the RMS of a difference of 51 in one channel is 51 / sqrt(3)
+        target, reference = self.images((151, 100, 100, 255), (100, 100, 100, 255))
+        self.assertEqual(0, image_diff(target, reference, 11.6)[0])
+        self.assertEqual(1, image_diff(target, reference, 11.5)[0])
+
+    def test_alpha(self):
+        target, reference = self.images((0, 0, 0, 0), (255, 255, 255, 0))
+        self.assertEqual(0, image_diff(target, reference, 0)[0])
+        target, reference = self.images((100, 100, 100, 204), (100, 100, 100, 255))
+        self.assertEqual(0, image_diff(target, reference, 20)[0])
+        self.assertEqual(1, image_diff(target, reference, 19.9)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
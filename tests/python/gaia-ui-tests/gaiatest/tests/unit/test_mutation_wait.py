@@ -0,0 +1,64 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from marionette_driver import expected, By
+from marionette_driver.errors import TimeoutException
+
+from gaiatest import GaiaTestCase
+from gaiatest.wait import MutationWait, condition_spec, element_has_class, element_present
+
+
+class TestMutationWait(GaiaTestCase):
+
+    def setUp(self):
+        GaiaTestCase.setUp(self)
+        self.marionette.switch_to_frame()
+
+    def tearDown(self):
+        self.marionette.execute_script("""
+          var element = document.getElementById('gaiatest-wait');
+          if (element) {
+            element.remove();
+          }""")
+        GaiaTestCase.tearDown(self)
+
+    def add_element_later(self, delay=500):
+        self.marionette.execute_script("""
+          window.setTimeout(function() {
+            var element = document.createElement('div');
+            element.id = 'gaiatest-wait';
+            element.textContent = 'gaiatest';
+            document.body.appendChild(element);
+          }, arguments[0]);""", [delay])
+
+    def test_condition_spec(self):
+        spec, element = condition_spec(element_present(By.ID, 'gaiatest-wait'))
+        self.assertEqual(spec, {'condition': 'present', 'using': 'id', 'value': 'gaiatest-wait'})
+        self.assertIsNone(element)
+        # the locators of expected conditions cannot be read, so they are polled
+        self.assertEqual(condition_spec(expected.element_present(By.ID, 'gaiatest-wait')), (None, None))
+
+    def test_element_present(self):
+        self.add_element_later()
+        element = MutationWait(self.marionette).until(element_present(By.ID, 'gaiatest-wait'))
+        self.assertEqual(element.text, 'gaiatest')
+
+    def test_class_added(self):
+        self.add_element_later(0)
+        element = MutationWait(self.marionette).until(element_present(By.ID, 'gaiatest-wait'))
+        self.marionette.execute_script("""
+          var element = arguments[0];
+          window.setTimeout(function() {
+            element.classList.add('ready');
+          }, 500);""", [element])
+        MutationWait(self.marionette).until(element_has_class(element, 'ready'))
+
+    def test_any_condition(self):
+        self.add_element_later()
+        MutationWait(self.marionette).until(
+            lambda m: m.execute_script("return !!document.getElementById('gaiatest-wait');"))
+
+    def test_timeout(self):
+        self.assertRaises(TimeoutException, MutationWait(self.marionette, timeout=1).until,
+                          element_present(By.ID, 'gaiatest-wait'))
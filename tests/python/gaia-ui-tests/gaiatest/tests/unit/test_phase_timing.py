@@ -0,0 +1,19 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+
+
+class TestPhaseTiming(GaiaTestCase):
+
+    def test_phase_timing(self):
+        with self.phase('settings'):
+            self.data_layer.get_setting('language.current')
+
+        durations = dict(self.phase_timer.durations())
+        for name in ['setUp', 'setUp/marionette', 'setUp/cleanup_storage',
+                     'setUp/cleanup_gaia', 'setUp/cleanup_gaia/prefs']:
+            self.assertIn(name, durations)
+        self.assertGreaterEqual(durations['setUp'], durations['setUp/cleanup_gaia'])
+        self.assertIn('test/settings', durations)
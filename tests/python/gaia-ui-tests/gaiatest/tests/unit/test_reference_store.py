@@ -0,0 +1,43 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from gaiatest.gaia_graphics_test import GaiaReferenceStore, REFERENCE_HASHES_FILENAME
+
+
+# needs no device, so it is run with unittest rather than listed in the manifest
+class TestReferenceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        Image.new('RGBA', (2, 2), 'red').save(os.path.join(self.path, 'test_a_page_device_en-US_0.png'))
+
+    def test_save_hashes(self):
+        store = GaiaReferenceStore(self.path)
+        reference = store.find('test_a', 'page', 'device', 'en-US', 0)
+        hashes = store.image_hashes(reference)
+        store.save()
+        self.assertEqual(hashes, tuple(GaiaReferenceStore(self.path).image_hashes(reference)))
+
+    def test_unwritable_directory(self):
+        # the hashes cannot be written over a directory, as in a read only reference tree
+        os.mkdir(os.path.join(self.path, REFERENCE_HASHES_FILENAME))
+        store = GaiaReferenceStore(self.path)
+        reference = store.find('test_a', 'page', 'device', 'en-US', 0)
+        hashes = store.image_hashes(reference)
+        store.save()
+        self.assertEqual(hashes, store.image_hashes(reference))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+
+from gaiatest import GaiaTestCase, SettleDetector
+
+
+class TestSettle(GaiaTestCase):
+
+    def test_settled_screen(self):
+        start = time.time()
+        self.assertTrue(SettleDetector(self.marionette).wait(10))
+        self.assertLess(time.time() - start, 10)
+
+    def test_unchanged_screen_waits(self):
+        # the screen has not been seen to change, so it may not have started to yet
+        start = time.time()
+        self.assertTrue(SettleDetector(self.marionette).wait(2, min_wait=1))
+        self.assertGreaterEqual(time.time() - start, 1)
+
+    def test_no_wait(self):
+        self.assertTrue(SettleDetector(self.marionette).wait(0))
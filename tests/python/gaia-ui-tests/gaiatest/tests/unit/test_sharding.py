@@ -0,0 +1,72 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+
+from manifestparser import TestManifest
+
+from gaiatest import GaiaTestCase
+from gaiatest.sharding import assign_tests, GaiaShard, GaiaTestDurations, split_arguments, write_manifest
+
+
+class TestSharding(GaiaTestCase):
+
+    def test_assign_tests_balances_weight(self):
+        tests = [{'path': 'test_%s.py' % name} for name in 'abcde']
+        weights = {'test_a.py': 5, 'test_b.py': 4, 'test_c.py': 3, 'test_d.py': 3, 'test_e.py': 1}
+        shards = assign_tests(tests, [GaiaShard(0), GaiaShard(1)], weight=lambda t: weights[t['path']])
+        self.assertEqual([8, 8], [s.weight for s in shards])
+        self.assertEqual(5, sum(len(s.tests) for s in shards))
+
+    def test_assign_tests_honours_capabilities(self):
+        tests = [{'path': 'test_sim.py', 'carrier': 'true'}, {'path': 'test_plain.py'}]
+        sim, plain = GaiaShard(0, capabilities=['carrier']), GaiaShard(1, capabilities=[])
+        assign_tests(tests, [plain, sim])
+        self.assertEqual(['test_sim.py'], [t['path'] for t in sim.tests])
+        self.assertEqual(['test_plain.py'], [t['path'] for t in plain.tests])
+
+    def test_assign_tests_without_shards(self):
+        self.assertRaises(ValueError, assign_tests, [{'path': 'test_a.py'}], [])
+
+    def test_durations_of_files_with_the_same_name(self):
+        tests = [{'path': '/tests/music/test_album.py', 'relpath': 'music/test_album.py'},
+                 {'path': '/tests/video/test_album.py', 'relpath': 'video/test_album.py'}]
+        durations = GaiaTestDurations(tests=tests)
+        for start, end, test in [(0, 10, tests[0]), (10, 30, tests[1])]:
+            durations.add_entry({'action': 'test_start', 'test': 'test_album.py TestAlbum.test_album',
+                                 'path': test['path'], 'time': start})
+            durations.add_entry({'action': 'test_end', 'test': 'test_album.py TestAlbum.test_album',
+                                 'time': end})
+        durations.save()
+        self.assertEqual(10, durations.weight(tests[0]))
+        self.assertEqual(20, durations.weight(tests[1]))
+
+    def test_split_arguments(self):
+        argv = ['--testvars', 'tv.json', '--devices=a,b', '--shards', '2', '--address', 'localhost:2828',
+                '--log-raw', 'raw.log', '--log-mach-verbose', '--restart', 'unit', '--type=b2g', 'functional']
+        arguments, tests = split_arguments(argv, ['unit', 'functional'])
+        self.assertEqual(['--testvars', 'tv.json', '--restart', '--type=b2g'], arguments)
+        self.assertEqual(['unit', 'functional'], tests)
+
+    def test_split_arguments_after_separator(self):
+        arguments, tests = split_arguments(['--restart', '--', '--odd-name.py'], ['--odd-name.py'])
+        self.assertEqual(['--restart'], arguments)
+        self.assertEqual(['--odd-name.py'], tests)
+
+    def test_write_manifest(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test_a.py')
+            tests = [{'path': path, 'relpath': 'test_a.py', 'carrier': 'true', 'expected': 'fail'}]
+            manifest = os.path.join(tmpdir, 'shard.ini')
+            write_manifest(tests, manifest)
+            written = TestManifest(manifests=[manifest], strict=False).tests
+            self.assertEqual(1, len(written))
+            self.assertEqual(path, written[0]['path'])
+            self.assertEqual('true', written[0]['carrier'])
+            self.assertEqual('fail', written[0]['expected'])
+        finally:
+            shutil.rmtree(tmpdir)
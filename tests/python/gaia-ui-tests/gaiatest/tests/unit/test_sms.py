@@ -0,0 +1,33 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+from gaiatest.mocks.mock_call import generate_calls
+from gaiatest.mocks.mock_sms import generate_sms
+
+
+class TestSms(GaiaTestCase):
+
+    def test_generators_are_deterministic(self):
+        self.assertEqual(list(generate_sms(3, 20, seed=1, end=0)),
+                         list(generate_sms(3, 20, seed=1, end=0)))
+        self.assertNotEqual(list(generate_sms(3, 20, seed=1, end=0)),
+                            list(generate_sms(3, 20, seed=2, end=0)))
+        self.assertEqual(list(generate_calls(3, 20, seed=1, end=0)),
+                         list(generate_calls(3, 20, seed=1, end=0)))
+
+    def test_generate_sms(self):
+        messages = list(generate_sms(threads=5, messages=50, min_length=20, max_length=40))
+        self.assertEqual(len(messages), 50)
+        self.assertEqual(len(set(m.number for m in messages)), 5)
+        self.assertTrue(all(20 <= len(m.body) <= 40 for m in messages))
+        timestamps = [m.timestamp for m in messages]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_insert_sms(self):
+        self.data_layer.delete_all_sms()
+        self.data_layer.insert_sms(list(generate_sms(threads=3, messages=10)), chunk_size=4)
+        self.assertEqual(len(self.data_layer.get_all_sms()), 10)
+        self.data_layer.delete_all_sms()
+        self.assertEqual(self.data_layer.get_all_sms(), [])
@@ -0,0 +1,173 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+import marionette_driver
+
+# frames from these files are never reported as the caller of a command
+_IGNORED_PATHS = (os.path.dirname(os.path.abspath(marionette_driver.__file__)),
+                  os.path.splitext(os.path.abspath(__file__))[0])
+
+# helpers sending commands on behalf of tests and page objects, which get the blame instead
+_HELPER_CLASSES = ('AppRegistry', 'AtomRegistry', 'ElementProbe', 'GaiaApps', 'GaiaData', 'MutationWait')
+
+
+def percentile(values, percent):
+    """Returns the value below which percent of the sorted values fall."""
+    if not values:
+        return 0
+    return values[max(int(math.ceil(len(values) * percent / 100.0)) - 1, 0)]
+
+
+def find_caller(frame):
+    """Returns a description of the first frame outside of Marionette which led to frame.
+
+    Methods are described by the class of their instance, so calls made by
+    page objects are attributed to the page object rather than to its base.
+    Methods of helpers such as :class:`GaiaApps` are skipped, so the commands
+    they send are attributed to the test or page object using them.
+    """
+    while frame is not None:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if not path.startswith(_IGNORED_PATHS) and frame.f_code.co_name != '_send_message':
+            instance = frame.f_locals.get('self')
+            if instance is None:
+                return '%s:%s' % (os.path.basename(path), frame.f_code.co_name)
+            if not any(c.__name__ in _HELPER_CLASSES for c in type(instance).__mro__):
+                return '%s.%s' % (type(instance).__name__, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class CommandTracer(object):
+    """Records the Marionette commands sent by a test.
+
+    The tracer listens to the session's :class:`~gaiatest.gaia_test.CommandHooks`,
+    so commands which were skipped rather than sent are not recorded.
+
+    :param context: the context commands are sent in when tracing starts.
+    """
+
+    def __init__(self, context=None):
+        self.context = context
+        self.commands = []
+
+    def after_command(self, name, params, result, error, duration):
+        self.commands.append((name, find_caller(sys._getframe(1)), self.context, duration))
+        if error is not None:
+            return
+        if name == 'setContext':
+            self.context = params.get('value')
+        elif name == 'getContext' and isinstance(result, basestring):
+            self.context = result
+
+    @property
+    def roundtrips(self):
+        return len(self.commands)
+
+    def summary(self, top=10):
+        """Returns counts and latencies of the recorded commands, in milliseconds."""
+        latencies = sorted(c[3] for c in self.commands)
+        commands = {}
+        contexts = {}
+        callers = {}
+        for name, caller, context, latency in self.commands:
+            commands[name] = commands.get(name, 0) + 1
+            contexts[context] = contexts.get(context, 0) + 1
+            calls, caller_ms = callers.get(caller, (0, 0))
+            callers[caller] = (calls + 1, caller_ms + latency)
+        top_callers = sorted(callers.items(), key=lambda c: (-c[1][0], c[0]))[:top]
+        return {
+            'roundtrips': len(self.commands),
+            'total_ms': round(sum(latencies), 1),
+            'median_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'commands': commands,
+            'contexts': dict((str(k), v) for k, v in contexts.items()),
+            'top_callers': [{'caller': caller, 'count': count, 'total_ms': round(total, 1)}
+                            for caller, (count, total) in top_callers]}
+
+
+class PhaseTimer(object):
+    """Times the phases of a test, nested phases being named after their parents.
+
+    The durations of all tests are added up in :attr:`totals` so a report of
+    where the time of a whole run went can be written at its end.
+    """
+
+    # phase name -> [number of times run, total seconds]
+    totals = OrderedDict()
+
+    def __init__(self):
+        self._stack = []
+        self._durations = OrderedDict()
+
+    def start(self, name):
+        path = '/'.join([p[0] for p in self._stack] + [name])
+        self._stack.append((name, path, time.time()))
+
+    def stop(self, name):
+        """Stop a phase and any phase started within it."""
+        if name not in [p[0] for p in self._stack]:
+            return
+        while True:
+            phase, path, start = self._stack.pop()
+            self._durations[path] = self._durations.get(path, 0) + time.time() - start
+            if phase == name:
+                break
+
+    @contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def durations(self):
+        """Returns a list of the names of the completed phases and their durations in seconds."""
+        return self._durations.items()
+
+    @classmethod
+    def add_totals(cls, durations, count=1):
+        for name, duration in durations:
+            total = cls.totals.setdefault(name, [0, 0])
+            total[0] += count
+            total[1] += duration
+
+    @classmethod
+    def read_report(cls, path):
+        """Add the totals of a JSON report written by another run."""
+        with open(path) as f:
+            report = json.load(f, object_pairs_hook=OrderedDict)
+        for name, phase in report.items():
+            cls.add_totals([(name, phase['total'])], count=phase['count'])
+
+    @classmethod
+    def write_report(cls, path):
+        """Write the totals as CSV if path ends with .csv, and as JSON otherwise.
+
+        The share of a phase is its part of the time spent in all top level phases.
+        """
+        run_total = sum(t[1] for name, t in cls.totals.items() if '/' not in name) or 1
+        rows = [(name, count, total, total / count, total / run_total)
+                for name, (count, total) in sorted(cls.totals.items())]
+        with open(path, 'wb' if path.endswith('.csv') else 'w') as f:
+            if path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(['phase', 'count', 'total', 'mean', 'share'])
+                for row in rows:
+                    writer.writerow([row[0], row[1]] + ['%.3f' % v for v in row[2:]])
+            else:
+                json.dump(OrderedDict((row[0], {'count': row[1], 'total': round(row[2], 3),
+                                                'mean': round(row[3], 3), 'share': round(row[4], 3)})
+                                      for row in rows), f, indent=2)
@@ -0,0 +1,190 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+
+from marionette_driver import expected, Wait
+from marionette_driver.errors import (JavascriptException, NoSuchElementException, ScriptTimeoutException,
+                                      StaleElementException, TimeoutException)
+from marionette_driver.marionette import HTMLElement
+
+from gaiatest.gaia_test import AtomRegistry, ElementProbe
+
+# conditions of marionette_driver.expected on an element which the gaia_wait atom can check
+EXPECTED_CONDITIONS = ('displayed', 'not_displayed', 'enabled', 'not_enabled', 'selected', 'not_selected')
+
+
+class element_present(expected.element_present):
+    """Checks that an element is present, as :class:`marionette_driver.expected.element_present`.
+
+    Unlike the expected condition, the locator is kept so the gaia_wait atom can check it.
+
+    :param by: the locator strategy.
+    :param locator: the locator.
+    """
+
+    def __init__(self, by, locator):
+        super(element_present, self).__init__(by, locator)
+        self.by = by
+        self.value = locator
+
+    @property
+    def spec(self):
+        if self.by not in ElementProbe.STRATEGIES:
+            return None
+        return {'condition': 'present', 'using': self.by, 'value': self.value}
+
+
+class element_not_present(expected.element_not_present):
+    """Checks that an element is not present, as :class:`marionette_driver.expected.element_not_present`.
+
+    :param by: the locator strategy.
+    :param locator: the locator.
+    """
+
+    def __init__(self, by, locator):
+        super(element_not_present, self).__init__(by, locator)
+        self.by = by
+        self.value = locator
+
+    @property
+    def spec(self):
+        if self.by not in ElementProbe.STRATEGIES:
+            return None
+        return {'condition': 'not_present', 'using': self.by, 'value': self.value}
+
+
+class element_attribute(object):
+    """Checks that an attribute of an element has a value.
+
+    :param element: the element to check.
+    :param name: name of the attribute.
+    :param value: expected value of the attribute, None if it should not be set.
+    """
+
+    def __init__(self, element, name, value):
+        self.el = element
+        self.name = name
+        self.value = value
+
+    @property
+    def spec(self):
+        return {'condition': 'attribute', 'name': self.name, 'expected': self.value}
+
+    def __call__(self, marionette):
+        return self.el.get_attribute(self.name) == self.value
+
+
+class element_has_class(object):
+    """Checks that an element has a class.
+
+    :param element: the element to check.
+    :param name: the class name.
+    """
+
+    def __init__(self, element, name):
+        self.el = element
+        self.name = name
+
+    @property
+    def spec(self):
+        return {'condition': 'class', 'name': self.name}
+
+    def __call__(self, marionette):
+        return self.name in (self.el.get_attribute('class') or '').split()
+
+
+class element_not_has_class(element_has_class):
+
+    @property
+    def spec(self):
+        return {'condition': 'not_class', 'name': self.name}
+
+    def __call__(self, marionette):
+        return not super(element_not_has_class, self).__call__(marionette)
+
+
+def condition_spec(condition):
+    """Returns how the gaia_wait atom can check condition, and the element it applies to.
+
+    The spec is None for conditions the atom cannot check.
+    """
+    spec = getattr(condition, 'spec', None)
+    element = getattr(condition, 'el', None)
+    element = element if isinstance(element, HTMLElement) else None
+    if spec is None and element is not None and type(condition).__module__ == expected.__name__:
+        name = type(condition).__name__.replace('element_', '', 1)
+        if name in EXPECTED_CONDITIONS:
+            spec = {'condition': name}
+    return spec, element
+
+
+class MutationWait(object):
+    """Waits for a condition by watching the document of the current frame instead of polling it.
+
+    Takes the same conditions as :class:`marionette_driver.Wait`. The
+    conditions :class:`element_present`, :class:`element_not_present`,
+    :class:`element_attribute` and :class:`element_has_class`, and those of
+    :mod:`marionette_driver.expected` given an element, are loosely checked on
+    the device whenever the document changes. Each time the device reports the condition met, or
+    after recheck seconds without it, the condition is checked the way
+    Marionette does. Other conditions may depend on state which changes
+    without the document changing, such as the checked property of an input,
+    so they are polled every interval as by :class:`marionette_driver.Wait`.
+
+    :param marionette: the Marionette session.
+    :param timeout: maximum time to wait in seconds, as for :class:`marionette_driver.Wait`.
+    :param interval: time to wait in seconds before watching again when the
+        device reported the condition met but it was not.
+    :param recheck: maximum time in seconds between two checks of the condition.
+    """
+
+    def __init__(self, marionette, timeout=None, interval=None, recheck=1):
+        wait = Wait(marionette, timeout=timeout, interval=interval)
+        self.marionette = marionette
+        self.timeout = wait.timeout
+        self.interval = wait.interval
+        self.recheck = recheck
+
+    def until(self, condition, message=''):
+        """Returns the value of condition once it is true.
+
+        :raises TimeoutException: if condition is still false after timeout.
+        """
+        spec, element = condition_spec(condition)
+        if spec is None:
+            return Wait(self.marionette, timeout=self.timeout,
+                        interval=self.interval).until(condition, message=message)
+        end = time.time() + self.timeout
+        AtomRegistry.get(self.marionette).import_script('gaia_probe.js')
+        AtomRegistry.get(self.marionette).import_script('gaia_wait.js')
+        met = False
+        while True:
+            result = self._check(condition)
+            if result:
+                return result
+            if met:
+                # the loose check disagrees with Marionette, so poll for a while
+                time.sleep(self.interval)
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            try:
+                met = self.marionette.execute_async_script(
+                    'GaiaWait.until(arguments[0], arguments[1], arguments[2]);',
+                    [spec, element, int(min(remaining, self.recheck) * 1000)],
+                    script_timeout=int(remaining * 1000) + 5000)
+            except (JavascriptException, ScriptTimeoutException, StaleElementException):
+                # the document cannot be watched, such as in the chrome context, or the
+                # element of the condition is gone
+                return Wait(self.marionette, timeout=max(end - time.time(), self.interval),
+                            interval=self.interval).until(condition, message=message)
+        raise TimeoutException('Timed out after %s seconds%s' % (
+            self.timeout, ' with message: %s' % message if message else ''))
+
+    def _check(self, condition):
+        try:
+            return condition(self.marionette)
+        except (NoSuchElementException, StaleElementException):
+            return False
@@ -53,5 +53,6 @@ setup(name='gaiatest',
       zip_safe=False,
       entry_points={'console_scripts': [
           'gaiatest = gaiatest.runtests:main',
-          'gcli = gaiatest.gcli:cli']},
+          'gcli = gaiatest.gcli:cli',
+          'gaiatest-bench = gaiatest.bench:cli']},
       install_requires=deps)